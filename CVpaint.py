@@ -1,13 +1,48 @@
-from flask import Flask, render_template, request, Response
-from opencv_camera import Camera
-import time
+from flask import Flask, render_template, request, Response, make_response, abort, send_file, jsonify
+from opencv_camera import CameraRegistry
+from sessions import SessionRegistry
+from pipeline import run_blocking
+import events
+import export
+import metrics
 import numpy as np
-from mini_project_4 import Model, Controller, View, process_frame
 import os
 import cv2
 
 app = Flask(__name__)
 
+# every browser gets its own drawing session, found by the id in its cookie
+sessions = SessionRegistry(max_workers = int(os.environ.get('CVPAINT_WORKERS', 4)),
+    idle_timeout = int(os.environ.get('CVPAINT_SESSION_TIMEOUT', 300)),
+    detection = {'backend': os.environ.get('CVPAINT_DETECTION_BACKEND', 'contours'),
+        'tracking': os.environ.get('CVPAINT_TRACKING', '1') == '1',
+        'scale': float(os.environ.get('CVPAINT_DETECTION_SCALE', 1)),
+        'refine': os.environ.get('CVPAINT_DETECTION_REFINE', '0') == '1'},
+    motion = {'threshold': int(os.environ.get('CVPAINT_MOTION_THRESHOLD', 12)), # 0 processes every frame
+        'refresh': int(os.environ.get('CVPAINT_MOTION_REFRESH', 30))},
+    quality = {'target_fps': float(os.environ.get('CVPAINT_TARGET_FPS', 20)),
+        'max_latency': float(os.environ.get('CVPAINT_MAX_LATENCY_MS', 250)) / 1000},
+    record_directory = os.environ.get('CVPAINT_RECORD_DIR')) # record every session's cursors there, to play them back with recording.py
+SESSION_COOKIE = 'cvpaint_session'
+cameras = CameraRegistry.from_environment() # every video source that can be streamed, by name
+RENDER = os.environ.get('CVPAINT_RENDER', 'server') # 'client' to have browsers draw the strokes themselves
+READY_TIMEOUT = float(os.environ.get('CVPAINT_READY_TIMEOUT', 2)) # how long /draw waits for a camera that is still opening
+
+metrics.active_clients.set_function(lambda: sum(pipeline.viewers + pipeline.listeners for pipeline in pipelines()))
+metrics.active_sessions.set_function(lambda: len(sessions.sessions))
+metrics.degraded_pipelines.set_function(lambda: sum(1 for pipeline in pipelines() if pipeline.quality.degraded()))
+metrics.stroke_points.set_function(lambda: sum(len(session.model.strokes) for session in list(sessions.sessions.values())))
+metrics.stroke_bytes.set_function(lambda: sum(session.model.strokes.nbytes for session in list(sessions.sessions.values())))
+
+def running(owner):
+    """Whether a session (or the session of a plain camera feed) has a pipeline running."""
+    return owner.pipeline is not None and owner.pipeline.running
+
+def pipelines():
+    """Every pipeline that is running, for the drawing sessions and the plain camera feeds."""
+    owners = list(sessions.sessions.values()) + list(sessions.cameras.values())
+    return [owner.pipeline for owner in owners if running(owner)]
+
 @app.route('/')
 def home():
     return render_template('home_screen.html')
@@ -20,36 +55,122 @@ def introduction():
 def rules():
     return render_template('rules.html')
 
+def camera(source):
+    """The camera for a source, started if it wasn't running, or a 404 page if there
+    is no source by that name."""
+    if source not in cameras.sources:
+        abort(404)
+    return cameras.get(source)
+
+def current_session():
+    """The session of the browser asking, found by its cookie, or a new one with a new id
+    if the cookie isn't for a session there is. Responses should go through with_cookie,
+    so it keeps the same one."""
+    return sessions.get(request.cookies.get(SESSION_COOKIE))
+
+def with_cookie(response, session):
+    """Sets the cookie for a session on a response, unless the browser already sent it."""
+    if request.cookies.get(SESSION_COOKIE) != session.id:
+        response.set_cookie(SESSION_COOKIE, session.id, httponly = True, samesite = 'Lax')
+    return response
+
 @app.route('/draw')
 def draw():
-    model.calibration_start = time.time()
-    return render_template('stream.html')
+    session = current_session()
+    session.model.calibration_start = session.model.clock()
+    session.model.calibration.reset()
+    render = request.args.get('render', RENDER)
+    source = request.args.get('source', 'default')
+    feed = camera(source) # start opening the camera now, so it is ready by the time the page asks for video
+    run_blocking(feed.wait_ready, READY_TIMEOUT) # give it a moment to get a frame, so the page can be laid out for its size
+    size = None if feed.frame is None else (feed.frame.shape[1], feed.frame.shape[0]) # not known if it is slow to open
+    return with_cookie(make_response(render_template('stream.html', client_render = render == 'client', source = source, size = size)), session)
 
 @app.route('/video_feed')
-def video_feed():
+@app.route('/video_feed/<source>')
+def video_feed(source = 'default'):
     """Video streaming route. Put this in the src attribute of an img tag."""
-    return Response(gen(Camera()),
-        mimetype='multipart/x-mixed-replace; boundary=frame') # continuously get frames from the camera
+    session = current_session()
+    pipeline = sessions.pipeline(session, camera(source))
+    return with_cookie(Response(gen(pipeline),
+        mimetype='multipart/x-mixed-replace; boundary=frame'), session) # continuously get frames from the camera
+
+@app.route('/camera_feed')
+@app.route('/camera_feed/<source>')
+def camera_feed(source = 'default'):
+    """Just the mirrored camera, shared by every client that draws the strokes itself."""
+    feed = camera(source)
+    pipeline = sessions.pipeline(sessions.camera_session(source), feed)
+    return Response(gen(pipeline),
+        mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/events')
+@app.route('/events/<source>')
+def stroke_events(source = 'default'):
+    """The cursors and the changes to the drawing after every frame, as Server-Sent Events."""
+    session = current_session()
+    pipeline = sessions.pipeline(session, camera(source)) # the session's frames still need to be processed to find the wands
+    return with_cookie(Response(events.stream(session, pipeline), mimetype='text/event-stream',
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}), session)
+
+def overlay_image(session, name):
+    with session.lock:
+        overlay = session.model.overlays[name]
+        if overlay.changes_with_color and overlay.color != session.model.line_color:
+            overlay.build(overlay.width)
+        image = np.zeros((overlay.top + overlay.image.shape[0], overlay.width, 4), np.uint8)
+        image[overlay.top:, :, 0:3] = overlay.image
+        image[overlay.top:, :, 3] = overlay.mask * 255
+    return image
+
+@app.route('/overlay/<name>.png')
+def overlay(name):
+    """One of the session's sets of buttons as a see-through PNG, to put on top of the video."""
+    session = current_session()
+    if name not in session.model.overlays:
+        return with_cookie(Response(status = 404), session)
+    image = run_blocking(overlay_image, session, name)
+    return with_cookie(Response(cv2.imencode('.png', image)[1].tobytes(), mimetype = 'image/png'), session)
+
+@app.route('/download/<kind>')
+def download(kind):
+    """The drawing the session saved last, as 'png', 'transparent' (a PNG of just the
+    drawing) or 'svg'. If it is still being written, this waits for it."""
+    session = current_session()
+    saved = session.model.last_export
+    if kind not in export.KINDS or saved is None:
+        abort(404)
+    if not run_blocking(saved.wait, 30):
+        return Response('The drawing could not be saved.', status = 500 if saved.done() else 503)
+    return send_file(saved.paths[kind], mimetype = export.KINDS[kind][1], as_attachment = True)
+
+@app.route('/quality')
+def quality():
+    """The settings the session's video and the plain camera feeds are being sent with
+    right now (see qos.py), and the timings they were picked from, as JSON."""
+    session = current_session()
+    return with_cookie(jsonify({'session': session.pipeline.quality.settings() if running(session) else None,
+        'cameras': {name: feed.pipeline.quality.settings() for name, feed in list(sessions.cameras.items()) if running(feed)}}), session)
+
+@app.route('/metrics')
+def show_metrics():
+    """Timings and counts for monitoring, in the Prometheus text format."""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
 
-def gen(camera):
+def gen(pipeline):
     """Video streaming generator function."""
-    while True:
-        frame = camera.get_frame() # get the frame in binary from Opencv
-        frame = np.frombuffer(frame, np.uint8) # turn the binary into an array
-        frame = cv2.imdecode(frame, cv2.IMREAD_UNCHANGED) # turn the array into an image
-        model.frame = frame # give that frame to the object that keeps track of everything
-        process_frame(model, controller, view) # run MP4 on the image
-        frame = cv2.imencode('.jpg', model.frame)[1].tobytes() # turn the image back into binary
+    timer = metrics.MetricsTimer(metrics.stage_seconds)
+    for frame in pipeline.frames(): # the newest frame, already processed and turned into a JPEG
+        timer.start()
         yield (b'--frame\r\n'
             b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n') # send the binary to the web app
+        timer.mark('send') # the server has finished writing the frame when it asks for the next one
 
 if __name__ == '__main__':
     """
-    All this function does is initialize everything we need for the web app to run.
+    All this function does is start the web app. The models for drawing are made
+    for each browser as it connects.
     """
-    model = Model()
-    view = View(model)
-    controller = Controller(model)
     HOST = '0.0.0.0' if 'PORT' in os.environ else '127.0.0.1'
     PORT = int(os.environ.get('PORT', 5000))
     app.run(host=HOST, port=PORT)
@@ -0,0 +1,355 @@
+"""
+Runs a recorded wand session through process_frame without a camera or a window, as
+fast as the computer can go, and writes out the video with the drawing on it and a log
+of everything that was drawn:
+
+    python batch.py session.mp4 --output annotated.mp4 --log session.jsonl --workers 8
+
+Time comes from the frame numbers instead of the clock, so calibrating takes as many
+frames as it did live, and running the same video twice gives the same result.
+
+With more than one worker, the video is split into chunks that are handled by a pool of
+processes. Only the tools need to go through the frames in order, and they are quick
+once the wands have been found, so the work is done in three passes that overlap:
+
+    1. Workers find the wands in each chunk, with the colors from calibrating.
+    2. The main process feeds the wands through the tools in order onto blank frames
+       (see ReplayController), which gives the log, and copies the model at the start of
+       every chunk.
+    3. Workers draw each chunk onto its real frames, starting from the copy of the
+       model, and write it out as a piece of the video. The pieces are joined at the end
+       by ffmpeg, so it needs to be installed to use more than one worker.
+
+Calibrating needs the real frames, so while it happens (at the start, and again if
+Calibrate is pressed) the main process reads them and finds the wands itself, and the
+workers only start finding wands once the colors are known.
+"""
+import argparse
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+import export
+from detection import Detector
+from mini_project_4 import Model, Controller, ReplayController, View, process_frame
+
+CALIBRATING = ('calibration color 1', 'calibration color 2')
+FOURCCS = {'.avi': 'MJPG', '.mp4': 'mp4v', '.mov': 'mp4v'}
+
+class FrameClock:
+    """
+    A clock for the model that gives the time of the frame being processed, counted from
+    the start of the video.
+    """
+    def __init__(self, fps):
+        self.fps = fps
+        self.frame = 0
+
+    def __call__(self):
+        return self.frame / self.fps
+
+class BatchModel(Model):
+    """
+    A Model that writes down everything done to the drawing in log, along with the frame
+    it was done on, and that can be copied to another process with pickle. Drawings are
+    only written out when Save is pressed if saving is True.
+    """
+    def __init__(self, fps):
+        Model.__init__(self)
+        self.clock = FrameClock(fps)
+        self.motion.threshold = 0 # a video is only run once, so skipping still frames just makes runs differ
+        self.saving = True
+        self.log = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['exporter'], state['last_export'], state['log'] # threads and locks can't be copied, and the log stays where it was written
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.exporter = export.exporter
+        self.last_export = None
+        self.log = []
+
+    def note(self, action, data = None):
+        self.log.append({'frame': self.clock.frame, 'time': round(self.clock(), 3), 'action': action, 'data': data})
+
+    def record(self, kind, data):
+        self.note(kind, data)
+        Model.record(self, kind, data)
+
+    def undo(self):
+        self.note('undo')
+        Model.undo(self)
+
+    def redo(self):
+        self.note('redo')
+        Model.redo(self)
+
+    def save_drawing(self):
+        self.note('save', self.export_count + 1)
+        if self.saving:
+            Model.save_drawing(self)
+        else:
+            self.export_count += 1 # so the drawings are numbered the same when they are written later
+
+    def wait_for_exports(self):
+        if self.last_export is not None: # exports are written in order, so this is the last to finish
+            self.last_export.wait()
+
+def read_frames(path, start = 0, end = None):
+    """
+    Yields (number, frame) for the frames of a video from start up to (but not
+    including) end, or to the end of the video.
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise RuntimeError('Could not open ' + path)
+    if start:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    number = start
+    try:
+        while end is None or number < end:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield number, frame
+            number += 1
+    finally:
+        capture.release()
+
+def video_info(path):
+    """
+    Returns the frames per second, (width, height) and number of frames of a video. The
+    number of frames is only what the file says, which can be a little off.
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise RuntimeError('Could not open ' + path)
+    info = (capture.get(cv2.CAP_PROP_FPS) or 30, (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))), int(capture.get(cv2.CAP_PROP_FRAME_COUNT)))
+    capture.release()
+    return info
+
+def open_writer(path, fourcc, fps, size):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    if not writer.isOpened():
+        raise RuntimeError('Could not write %s with codec %s' % (path, fourcc))
+    return writer
+
+def find_wands(path, start, end, bounds, detection):
+    """
+    Finds the wands in frames start to end of a video, the way process_frame would with
+    the given (lower, upper) colors. Returns the blobs of both wands in every frame.
+    Runs in a worker.
+    """
+    detector = Detector(**detection)
+    return [detector.detect(cv2.flip(frame, 1), bounds) for number, frame in read_frames(path, start, end)]
+
+def render(path, start, end, state, cursors, segment, fourcc, fps, size):
+    """
+    Processes frames start to end of a video from a pickled BatchModel, with the cursors
+    found for them, and writes them to segment. Runs in a worker.
+    """
+    model = pickle.loads(state)
+    model.saving = True
+    view = View(model)
+    controller = ReplayController(model)
+    writer = open_writer(segment, fourcc, fps, size)
+    for (number, frame), wands in zip(read_frames(path, start, end), cursors):
+        model.clock.frame = number
+        model.frame = frame
+        controller.add(wands)
+        process_frame(model, controller, view)
+        writer.write(model.frame)
+    writer.release()
+    model.wait_for_exports()
+
+def join(segments, output):
+    """
+    Joins the pieces of the video into one with ffmpeg, which copies the frames as they
+    are instead of encoding them again. Encoding them again would lose more of the
+    picture, so without ffmpeg this raises an error instead (main checks for it before
+    starting, see can_join).
+    """
+    if not can_join():
+        raise RuntimeError('ffmpeg is needed to join the pieces of the video from several workers, install it or use --workers 1')
+    listing = os.path.join(os.path.dirname(segments[0]), 'segments.txt')
+    with open(listing, 'w') as file:
+        file.writelines("file '%s'\n" % os.path.abspath(segment) for segment in segments)
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', listing, '-c', 'copy', output], check = True)
+
+def can_join():
+    return shutil.which('ffmpeg') is not None
+
+def run_sequential(path, output, model, detection, fourcc):
+    """
+    Processes the whole video in this process, one frame after another. Returns how many
+    frames there were.
+    """
+    fps, size, count = video_info(path)
+    view = View(model)
+    controller = Controller(model, **detection)
+    writer = open_writer(output, fourcc, fps, size)
+    count = 0
+    for number, frame in read_frames(path):
+        model.clock.frame = number
+        model.frame = frame
+        process_frame(model, controller, view)
+        writer.write(model.frame)
+        count += 1
+    writer.release()
+    model.wait_for_exports()
+    return count
+
+def run_parallel(path, output, model, detection, fourcc, workers, chunk_frames):
+    """
+    Processes the video with a pool of workers, in the three passes described at the
+    top. Returns how many frames there were.
+    """
+    fps, size, count = video_info(path)
+    view = View(model)
+    finder = Controller(model, **detection) # for frames where the main process has to find the wands itself
+    replay = ReplayController(model, blobs = True, **detection)
+    blank = np.zeros((size[1], size[0], 3), np.uint8)
+    model.saving = False # the workers save the drawings, on top of the real frames
+    cursors = [] # the cursors of every frame so far, for the workers drawing the chunks
+    directory = tempfile.mkdtemp(prefix = 'batch-', dir = os.path.dirname(os.path.abspath(output)))
+    segments = []
+    renders = deque()
+    found = deque() # (chunk of blobs being found, how many frames it should have)
+    blobs = deque() # blobs of the frames coming up, from the chunks found so far
+    ended = False # whether the chunk the video ends in has been found
+    reader = None
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            def finish_chunk(start, end, state):
+                segment = os.path.join(directory, 'segment-%05d%s' % (len(segments), os.path.splitext(output)[1]))
+                segments.append(segment)
+                renders.append(pool.submit(render, path, start, end, state, cursors[start:end], segment, fourcc, fps, size))
+                while len(renders) > 2 * workers: # each one holds a copy of the model, so don't get too far ahead
+                    renders.popleft().result()
+
+            number = 0
+            chunk_start, state = 0, pickle.dumps(model)
+            while True:
+                if model.tool in CALIBRATING:
+                    for chunk, length in found:
+                        chunk.cancel()
+                    found.clear()
+                    blobs.clear()
+                    ended = False
+                    if reader is None:
+                        reader = read_frames(path, number)
+                    item = next(reader, None)
+                    if item is None:
+                        break
+                    model.frame = item[1]
+                    controller = finder
+                else:
+                    if reader is not None:
+                        reader.close()
+                        reader = None
+                    if not found and not blobs and not ended: # the colors are known, so the rest of the video can be handed out
+                        bounds = [(model.lower_color_1, model.upper_color_1), (model.lower_color_2, model.upper_color_2)]
+                        for start in range(number, max(count, number + 1), chunk_frames):
+                            end = start + chunk_frames if start + chunk_frames < count else None # the last one goes to the real end of the video
+                            found.append((pool.submit(find_wands, path, start, end, bounds, detection), chunk_frames))
+                    if not blobs and found:
+                        chunk, length = found.popleft()
+                        blobs.extend(chunk.result())
+                        if len(blobs) < length:
+                            ended = True
+                            for chunk, length in found:
+                                chunk.cancel()
+                            found.clear()
+                    if not blobs:
+                        break
+                    replay.add(blobs.popleft())
+                    model.frame = blank
+                    controller = replay
+                model.clock.frame = number
+                process_frame(model, controller, view)
+                cursors.append((model.cursor_1, model.cursor_2))
+                number += 1
+                if number - chunk_start == chunk_frames:
+                    finish_chunk(chunk_start, number, state)
+                    chunk_start, state = number, pickle.dumps(model)
+            if number > chunk_start:
+                finish_chunk(chunk_start, number, state)
+            for chunk, length in found:
+                chunk.cancel()
+            while renders:
+                renders.popleft().result()
+        if segments:
+            join(segments, output)
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+    return number
+
+def plain(value):
+    """
+    Turns numpy numbers and arrays in the log into lists and numbers JSON can hold.
+    """
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError('Can not write %r to the log' % (value,))
+
+def write_log(path, log):
+    """
+    Writes the log as JSON lines, one action per line.
+    """
+    with open(path, 'w') as file:
+        for entry in log:
+            file.write(json.dumps(entry, default = plain) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Process a recorded session without a camera, writing the annotated video and a log of the drawing.')
+    parser.add_argument('video', help = 'the recorded video')
+    parser.add_argument('--output', help = 'where to write the annotated video (VIDEO-annotated, with the same extension, if not given)')
+    parser.add_argument('--log', help = 'where to write the log of the drawing as JSON lines (VIDEO.jsonl if not given)')
+    parser.add_argument('--drawings', help = 'folder for drawings saved during the session (VIDEO-drawings if not given)')
+    parser.add_argument('--fourcc', help = 'codec of the annotated video (picked from its extension if not given)')
+    parser.add_argument('--workers', type = int, help = 'processes to split the video between (1 does it all in this process). More than 1 needs ffmpeg to join the pieces, and is the number of CPUs if ffmpeg is installed and this is not given')
+    parser.add_argument('--chunk-seconds', type = float, default = 10, help = 'how much of the video each worker gets at a time')
+    parser.add_argument('--calibration-time', type = float, help = 'seconds each wand was held up for calibrating, if not the usual')
+    parser.add_argument('--backend', default = 'contours', help = 'detection backend')
+    parser.add_argument('--tracking', action = 'store_true', help = 'track the wands between frames (chunks start without tracks, so results can differ a little from one worker)')
+    parser.add_argument('--scale', type = float, default = 1, help = 'scale to shrink frames by for detection')
+    parser.add_argument('--refine', action = 'store_true', help = 'refine positions found on shrunk frames at full size')
+    args = parser.parse_args()
+    if args.workers is None:
+        args.workers = os.cpu_count() if can_join() else 1
+    elif args.workers > 1 and not can_join():
+        parser.error('ffmpeg is needed to join the pieces of the video from several workers, install it or use --workers 1')
+
+    stem, extension = os.path.splitext(args.video)
+    output = args.output or stem + '-annotated' + extension
+    fourcc = args.fourcc or FOURCCS.get(os.path.splitext(output)[1].lower(), 'mp4v')
+    detection = {'backend': args.backend, 'tracking': args.tracking, 'scale': args.scale, 'refine': args.refine}
+    fps, size, count = video_info(args.video)
+    model = BatchModel(fps)
+    if args.calibration_time:
+        model.calibration_time = args.calibration_time
+    model.export_directory = args.drawings or stem + '-drawings'
+
+    started = time.perf_counter()
+    if args.workers > 1:
+        frames = run_parallel(args.video, output, model, detection, fourcc, args.workers, max(int(args.chunk_seconds * fps), 1))
+    else:
+        frames = run_sequential(args.video, output, model, detection, fourcc)
+    model.finish() # a line still being drawn when the video ends goes in the log too
+    write_log(args.log or stem + '.jsonl', model.log)
+    elapsed = time.perf_counter() - started
+    print('%d frames in %.1f s: %.1f fps, %.1f times real time' % (frames, elapsed, frames / elapsed, frames / fps / elapsed), file = sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+Measures how fast process_frame runs without needing a webcam. Frames come either from
+a synthetic scene, where colored blobs stand in for the wands and act out a script
+(calibrating, drawing, making shapes and erasing), or from a recorded video. A
+recording of a session (see recording.py) can be played back too, which times just the
+tools and drawing, without finding the wands. Each run
+reports how long every stage of a frame takes as JSON, so results can be saved and
+compared between versions:
+
+    python benchmark.py --output new.json --compare old.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+import cv2
+from mini_project_4 import Model, Controller, View, process_frame
+from profiling import StageTimer
+import recording
+
+WAND_1 = (200,40,40) # BGR colors of the fake wands, which are easy to tell apart in HSV
+WAND_2 = (40,200,40)
+WAND_RADIUS = 36
+
+# where to put the selecting wand to press each button (the middle of the button)
+BUTTONS = {'pen': (101,45), 'erase': (157,45), 'rectangle': (325,45), 'ellipse': (381,45)}
+
+class SyntheticScene:
+    """
+    Makes fake camera frames with a blob for each wand on a noisy gray background.
+    Positions are given as they will appear on screen, and the frame is mirrored to
+    match what a camera sends (process_frame flips it back).
+    """
+    def __init__(self, width, height, seed = 0):
+        self.width = width
+        self.height = height
+        random = np.random.default_rng(seed)
+        gray = random.integers(70, 110, (height, width, 1), dtype = np.uint8) # camera noise, but without any color
+        self.background = np.repeat(gray, 3, axis = 2)
+
+    def frame(self, cursor_1 = None, cursor_2 = None):
+        frame = self.background.copy()
+        if cursor_1 is not None:
+            cv2.circle(frame, (self.width - 1 - int(cursor_1[0]), int(cursor_1[1])), WAND_RADIUS, WAND_1, -1)
+        if cursor_2 is not None:
+            cv2.circle(frame, (self.width - 1 - int(cursor_2[0]), int(cursor_2[1])), WAND_RADIUS, WAND_2, -1)
+        return frame
+
+def script(width, height, fps, calibration_time, draw_frames):
+    """
+    The steps the fake wands act out, as (phase, cursor_1, cursor_2) for every frame.
+    """
+    center = (width / 2, height / 2)
+    steps = []
+    for i in range(int(calibration_time * fps) + 2): # hold each wand in the calibration circle
+        steps.append(('calibration', center, None))
+    for i in range(int(calibration_time * fps) + 2):
+        steps.append(('calibration', None, center))
+
+    def path(i, count, scale = 1):
+        angle = 2 * np.pi * i / count
+        return (width / 2 + scale * width / 3 * np.cos(angle), height * 0.6 + scale * height / 4 * np.sin(2 * angle))
+
+    for i in range(draw_frames):
+        steps.append(('draw', path(i, draw_frames), None))
+
+    for button, shape_scale in (('rectangle', 0.5), ('ellipse', 0.3)):
+        for i in range(3):
+            steps.append(('shapes', None, BUTTONS[button]))
+        for i in range(30): # drag out the shape with the drawing wand
+            steps.append(('shapes', path(i, 120, shape_scale), None))
+        for i in range(3): # then finish it with the selecting wand
+            steps.append(('shapes', None, path(30, 120, shape_scale)))
+
+    for i in range(3):
+        steps.append(('erase', None, BUTTONS['erase']))
+    for i in range(draw_frames // 2):
+        steps.append(('erase', path(i, draw_frames), None))
+    for i in range(3):
+        steps.append(('erase', None, BUTTONS['pen']))
+    return steps
+
+def fill_history(model, shape, segments, seed = 0):
+    """
+    Draws a random scribble with this many segments before the benchmark starts, to see
+    how the size of the drawing affects the time per frame.
+    """
+    model.canvas.fit(np.zeros(shape, np.uint8))
+    random = np.random.default_rng(seed)
+    x, y = shape[1] / 2, shape[0] / 2
+    for i in range(segments + 1):
+        if i % 200 == 0:
+            model.add_line_point(False) # start a new line every so often
+        x = float(np.clip(x + random.integers(-12, 13), 0, shape[1] - 1))
+        y = float(np.clip(y + random.integers(-12, 13), 100, shape[0] - 1))
+        model.add_line_point((int(x), int(y), (0,0,255), 0, 7))
+
+def run(frames, model, controller, view, fps):
+    """
+    Runs every frame through process_frame and encodes the result, like the web app does.
+    frames can be any iterable of (phase, frame). Returns the timers for the whole run
+    and for each phase, and how many frames there were.
+    """
+    total = StageTimer()
+    phases = {}
+    fake_time = model.clock()
+    model.clock = lambda: fake_time
+    model.calibration_start = fake_time
+    count = 0
+    started = time.perf_counter()
+    for phase, frame in frames:
+        count += 1
+        timer = phases.setdefault(phase, StageTimer())
+        model.timer = timer
+        model.frame = frame
+        process_frame(model, controller, view)
+        cv2.imencode('.jpg', model.frame)
+        timer.mark('encode')
+        fake_time += 1 / fps
+    elapsed = time.perf_counter() - started
+    for timer in phases.values():
+        for stage, samples in timer.samples.items():
+            total.samples.setdefault(stage, []).extend(samples)
+    return total, phases, count, elapsed
+
+def report(source, shape, history, options, count, total, phases, elapsed):
+    per_frame = sum(np.sum(samples) for samples in total.samples.values()) / count
+    return {'source': source,
+        'resolution': [shape[1], shape[0]],
+        'history': history,
+        'detection': options,
+        'frames': count,
+        'fps': round(1 / per_frame, 2) if per_frame else None,
+        'wall_seconds': round(elapsed, 3),
+        'stages': total.summary(),
+        'phases': {phase: timer.summary() for phase, timer in phases.items()}}
+
+def benchmark_synthetic(width, height, history, options, fps = 30, calibration_time = 1, draw_frames = 300):
+    model = Model()
+    model.calibration_time = calibration_time
+    view = View(model)
+    controller = Controller(model, **options)
+    fill_history(model, (height, width, 3), history)
+    scene = SyntheticScene(width, height)
+    frames = ((phase, scene.frame(cursor_1, cursor_2)) for phase, cursor_1, cursor_2 in script(width, height, fps, calibration_time, draw_frames)) # made as they are needed
+    total, phases, count, elapsed = run(frames, model, controller, view, fps)
+    return report('synthetic', (height, width), history, options, count, total, phases, elapsed)
+
+def benchmark_video(path, history, options, max_frames = 1000):
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise RuntimeError('Could not open ' + path)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+    frames = []
+    while len(frames) < max_frames:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frames.append(('video', frame))
+    capture.release()
+    if not frames:
+        raise RuntimeError('No frames in ' + path)
+    model = Model()
+    view = View(model)
+    controller = Controller(model, **options)
+    fill_history(model, frames[0][1].shape, history)
+    total, phases, count, elapsed = run(frames, model, controller, view, fps)
+    return report(path, frames[0][1].shape, history, options, count, total, phases, elapsed)
+
+def benchmark_recording(path, history):
+    frames = recording.load(path)
+    if not frames:
+        raise RuntimeError('No frames in ' + path)
+    shape = (frames[0].size[1], frames[0].size[0], 3)
+    model = Model()
+    fill_history(model, shape, history)
+    timer = StageTimer()
+    started = time.perf_counter()
+    recording.replay(frames, model, timer)
+    elapsed = time.perf_counter() - started
+    return report(path, shape, history, {'replay': True}, len(frames), timer, {'replay': timer}, elapsed)
+
+def compare(old, new, tolerance):
+    """
+    Prints how much slower or faster every stage got, and returns the stages that got
+    slower by more than the tolerance (0.2 is 20%).
+    """
+    regressions = []
+    old_results = {(r['source'], tuple(r['resolution']), r['history'], json.dumps(r['detection'], sort_keys = True)): r for r in old['results']}
+    for result in new['results']:
+        key = (result['source'], tuple(result['resolution']), result['history'], json.dumps(result['detection'], sort_keys = True))
+        if key not in old_results:
+            continue
+        for stage, stats in result['stages'].items():
+            before = old_results[key]['stages'].get(stage)
+            if not before or not before['mean_ms']:
+                continue
+            change = stats['mean_ms'] / before['mean_ms'] - 1
+            print('%s %dx%d history=%d %-10s %8.3f ms -> %8.3f ms (%+.0f%%)' % (key[0], key[1][0], key[1][1], key[2], stage, before['mean_ms'], stats['mean_ms'], change * 100), file = sys.stderr)
+            if change > tolerance:
+                regressions.append((key, stage, change))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark process_frame without a camera.')
+    parser.add_argument('--resolutions', default = '640x480,1280x720,1920x1080', help = 'comma separated WIDTHxHEIGHT sizes of synthetic frames')
+    parser.add_argument('--history', default = '0,10000', help = 'comma separated numbers of segments drawn before starting')
+    parser.add_argument('--video', action = 'append', default = [], help = 'a recorded video to run as well (can be given more than once)')
+    parser.add_argument('--recording', action = 'append', default = [], help = 'a recording of a session to play back as well (can be given more than once)')
+    parser.add_argument('--backend', default = 'contours', help = 'comma separated detection backends to try')
+    parser.add_argument('--tracking', default = '0,1', help = 'comma separated tracking settings to try (0 or 1)')
+    parser.add_argument('--scale', default = '1', help = 'comma separated scales to shrink frames by for detection')
+    parser.add_argument('--refine', action = 'store_true', help = 'refine positions found on shrunk frames at full size')
+    parser.add_argument('--draw-frames', type = int, default = 300, help = 'number of frames spent drawing in the synthetic script')
+    parser.add_argument('--output', help = 'file to write the JSON results to (printed if not given)')
+    parser.add_argument('--compare', help = 'JSON results from an earlier run to compare against')
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = 'how much slower a stage can get before --compare fails')
+    args = parser.parse_args()
+
+    histories = [int(i) for i in args.history.split(',')]
+    options = [{'backend': backend, 'tracking': tracking == '1', 'scale': float(scale), 'refine': args.refine}
+        for backend in args.backend.split(',') for tracking in args.tracking.split(',') for scale in args.scale.split(',')]
+    results = []
+    for resolution in args.resolutions.split(','):
+        width, height = (int(i) for i in resolution.split('x'))
+        for history in histories:
+            for option in options:
+                results.append(benchmark_synthetic(width, height, history, option, draw_frames = args.draw_frames))
+                print('%dx%d history=%d %s: %.1f fps' % (width, height, history, option, results[-1]['fps']), file = sys.stderr)
+    for path in args.video:
+        for history in histories:
+            for option in options:
+                results.append(benchmark_video(path, history, option))
+                print('%s history=%d %s: %.1f fps' % (path, history, option, results[-1]['fps']), file = sys.stderr)
+
+    for path in args.recording:
+        for history in histories:
+            results.append(benchmark_recording(path, history))
+            print('%s history=%d replay: %.1f fps' % (path, history, results[-1]['fps']), file = sys.stderr)
+
+    output = {'python': platform.python_version(), 'opencv': cv2.__version__, 'numpy': np.__version__, 'results': results}
+    text = json.dumps(output, indent = 2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), output, args.tolerance)
+        if regressions:
+            print('%d stages got more than %d%% slower' % (len(regressions), args.tolerance * 100), file = sys.stderr)
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,10 @@ class Button:
         self.pressed = pressed
         self.model = model
         self.icon = cv2.imread(os.path.dirname(__file__) + '/Icons/' + path, -1)
+        self.icon_mask = self.icon[0:size, 0:size, 3] > 20 # the pixels of the icon that aren't see-through
+        self.icon_colors = self.icon[0:size, 0:size, 0:3]
+
+    changes_with_color = False # whether the button looks different when the drawing color changes
 
     def check_pressed(self,cursor):
         if cursor:
@@ -25,38 +29,55 @@ class Button:
                 if not self.pressed:
                     self.press()
                     self.pressed = True
+                    self.model.pressed_buttons.append(self)
             else: #Debounce
                 self.pressed = False
 
     def display(self,frame):
-        for i in range(self.size):
-            for j in range(self.size):
-                if self.icon[i,j][3] > 20:
-                    frame[self.y+i,self.x+j] = self.icon[i,j][0:-1]
+        area = frame[self.y:self.y+self.size, self.x:self.x+self.size]
+        np.copyto(area, self.icon_colors, where=self.icon_mask[:, :, None])
+
+    def render(self, image, mask):
+        """
+        Draws the button onto the image of an overlay, and marks the pixels it
+        covers in the overlay's mask.
+        """
+        self.display(image)
+        mask[self.y:self.y+self.size, self.x:self.x+self.size] |= self.icon_mask
 
 class Save_Button(Button):
     """
     A class for adding a save button to the program. Inherets from Button class.
-    The Save button saves current drawing to project folder as Drawing.png.
+    The Save button saves the current drawing to the model's export_directory, as a
+    picture and as an SVG (see Model.save_drawing).
     """
-    def __init__(self,x,y,path,size,model,pressed = False):
-        super().__init__(x,y,path,size,model)
-        self.images_counter = 0
-
     def press(self):
         self.model.tool = 'save'
 
 class Clear_Button(Button):
     """
     A class for adding a clear button to the program. Inherets from Button class.
-    The Clear button clears current drawing from screen by emptying points, where all
-    previous wand locations are stored.
+    The Clear button clears current drawing from screen by emptying the stroke store, where
+    all previous wand locations are stored. It can be undone like anything else.
     """
     def press(self):
-        self.model.line_points.clear()
-        self.model.line_points.append(False)
-        self.model.rectangle_points.clear()
-        self.model.ellipse_points.clear()
+        self.model.finish()
+        self.model.clear_drawing()
+        self.model.record('clear', None) # so it can be undone
+
+class Undo_Button(Button):
+    """
+    A class for taking back the last thing drawn, erased or cleared.
+    """
+    def press(self):
+        self.model.undo()
+
+class Redo_Button(Button):
+    """
+    A class for putting back the last thing that was undone.
+    """
+    def press(self):
+        self.model.redo()
 
 class Thicknessess_Button(Button):
     """
@@ -86,7 +107,8 @@ class Calibration_Button(Button):
     """
     def press(self):
         self.model.tool = 'calibration color 1'
-        self.model.calibration_start = time.time()
+        self.model.calibration_start = self.model.clock()
+        self.model.calibration.reset()
 
 class Rectangle_Button(Button):
     """
@@ -135,8 +157,12 @@ class Color_Slider():
         self.pressed = pressed
         self.model = model
         self.icon = cv2.imread(os.path.dirname(__file__) + '/Icons/' + path, -1)
+        self.icon_mask = self.icon[0:dy, 0:dx, 3] > 20
+        self.icon_colors = self.icon[0:dy, 0:dx, 0:3]
         self.selected = (0,255,0)
 
+    changes_with_color = False
+
 
     def check_pressed(self,cursor):
         if cursor:
@@ -152,23 +178,73 @@ class Color_Slider():
                 self.pressed = False
 
     def display(self,frame):
-        for i in range(self.dy):
-            for j in range(self.dx):
-                if self.icon[i,j][3] > 20:
-                    frame[self.y+i,self.x+j] = self.icon[i,j][0:-1]
+        area = frame[self.y:self.y+self.dy, self.x:self.x+self.dx]
+        np.copyto(area, self.icon_colors, where=self.icon_mask[:, :, None])
+
+    def render(self, image, mask):
+        self.display(image)
+        mask[self.y:self.y+self.dy, self.x:self.x+self.dx] |= self.icon_mask
 
 class Color_Choice(Button):
     """
     A class for adding a color button to the program. Inherets from Button class.
     Color buttons change the color of the users drawing.
     """
+    changes_with_color = True
+
     def press(self):
         self.model.tool = 'draw' #if eraser thickness button pressed, start erasing again
 
 
     def display(self,frame):
-        cv2.rectangle(self.model.frame,(self.x,self.y),(self.x+self.size,self.y+self.size), self.model.line_color,-1) # makes the button the current color of the cursor
-        for i in range(self.size): # puts the check mark icon over top of the colored rectangle
-            for j in range(self.size):
-                if self.icon[i,j][3] > 20:
-                    frame[self.y+i,self.x+j] = self.icon[i,j][0:-1]
+        cv2.rectangle(frame,(self.x,self.y),(self.x+self.size,self.y+self.size), self.model.line_color,-1) # makes the button the current color of the cursor
+        super().display(frame) # puts the check mark icon over top of the colored rectangle
+
+    def render(self, image, mask):
+        self.display(image)
+        mask[self.y:self.y+self.size+1, self.x:self.x+self.size+1] = True # the colored rectangle covers all of it
+
+class Overlay():
+    """
+    A picture of a whole set of interface elements, along with a mask of the pixels
+    they cover. It is drawn once, and then put onto each frame in one step instead of
+    drawing every button pixel by pixel every frame. It only gets drawn again if the
+    frame changes width, or if one of the elements depends on the drawing color and
+    that color changes.
+    band is the (top, bottom) rows of a white strip across the frame behind the elements.
+    """
+    def __init__(self, elements, model, band = None, width = 640):
+        self.elements = elements
+        self.model = model
+        self.band = band
+        self.changes_with_color = any(element.changes_with_color for element in elements)
+        self.top = min([element.y for element in elements] + ([band[0]] if band else []))
+        self.bottom = max([element.y + element.icon_mask.shape[0] + 1 for element in elements] + ([band[1] + 1] if band else []))
+        self.build(width)
+
+    def build(self, width):
+        """
+        Draws all of the elements onto a fresh overlay image and mask.
+        """
+        self.width = width
+        self.color = self.model.line_color
+        right = max([width] + [element.x + element.icon_mask.shape[1] + 1 for element in self.elements])
+        image = np.zeros((self.bottom, right, 3), np.uint8)
+        mask = np.zeros((self.bottom, right), bool)
+        if self.band:
+            image[self.band[0]:self.band[1]+1, 0:width] = 255
+            mask[self.band[0]:self.band[1]+1, 0:width] = True
+        for element in self.elements:
+            element.render(image, mask)
+        self.image = np.ascontiguousarray(image[self.top:, 0:width])
+        self.mask = mask[self.top:, 0:width].astype(np.uint8)
+
+    def display(self, frame):
+        """
+        Puts the whole overlay onto the frame with a single masked copy.
+        """
+        if frame.shape[1] != self.width or (self.changes_with_color and self.model.line_color != self.color):
+            self.build(frame.shape[1])
+        height = min(self.bottom, frame.shape[0]) - self.top
+        if height > 0:
+            cv2.copyTo(self.image[0:height], self.mask[0:height], frame[self.top:self.top+height])
@@ -0,0 +1,72 @@
+import numpy as np
+import cv2
+
+class Calibration:
+    """
+    Learns the color of a wand held in the calibration circle. Every frame of the
+    calibration window, the hue, saturation and value of the pixels inside the circle
+    are added to histograms, and at the end the range of colors is taken from the
+    middle of those histograms (between the low and high percentiles), so a few frames
+    of the wand not being there yet or a glint of light don't throw it off. Only the
+    small square around the circle is ever converted to HSV.
+
+    Pixels with hardly any color (saturation or value below min_saturation or
+    min_value) don't count, since their hue is meaningless. Hue goes round in a circle
+    (red is near both 0 and 179), so its range is worked out around the most common
+    hue, and may wrap around (see detection.in_range).
+    """
+    def __init__(self, radius = 40, low = 5, high = 95, hue_margin = 4, margin = 40, min_saturation = 40, min_value = 40):
+        self.radius = radius
+        self.low = low
+        self.high = high
+        self.hue_margin = hue_margin
+        self.margin = margin # how far past the percentiles saturation and value may go
+        self.min_saturation = min_saturation
+        self.min_value = min_value
+        circle = np.zeros((2 * radius + 1, 2 * radius + 1), np.uint8)
+        cv2.circle(circle, (radius, radius), radius, 1, -1)
+        self.circle = circle.astype(bool) # which pixels of the square around the circle are in it
+        self.reset()
+
+    def reset(self):
+        self.hue = np.zeros(180, np.int64)
+        self.saturation = np.zeros(256, np.int64)
+        self.value = np.zeros(256, np.int64)
+
+    def add(self, frame):
+        """
+        Adds the colors inside the calibration circle of a frame to the histograms.
+        """
+        x1, y1 = frame.shape[1] // 2 - self.radius, frame.shape[0] // 2 - self.radius
+        hsv = cv2.cvtColor(frame[y1:y1 + self.circle.shape[0], x1:x1 + self.circle.shape[1]], cv2.COLOR_BGR2HSV)
+        pixels = hsv[self.circle[0:hsv.shape[0], 0:hsv.shape[1]]]
+        pixels = pixels[(pixels[:, 1] >= self.min_saturation) & (pixels[:, 2] >= self.min_value)]
+        self.hue += np.bincount(pixels[:, 0], minlength = 180)[0:180]
+        self.saturation += np.bincount(pixels[:, 1], minlength = 256)
+        self.value += np.bincount(pixels[:, 2], minlength = 256)
+
+    @staticmethod
+    def percentiles(histogram, low, high):
+        cumulative = np.cumsum(histogram) / histogram.sum()
+        return int(np.searchsorted(cumulative, low / 100)), int(np.searchsorted(cumulative, high / 100))
+
+    def bounds(self):
+        """
+        Returns the (lower, upper) HSV colors of the wand, or None if no colored pixels
+        were seen at all. The lower hue is bigger than the upper one when the range
+        wraps around.
+        """
+        if not self.hue.any():
+            return None
+        shift = 90 - int(np.argmax(self.hue)) # put the most common hue in the middle, so the range around it doesn't wrap
+        low, high = self.percentiles(np.roll(self.hue, shift), self.low, self.high)
+        low, high = low - self.hue_margin, high + self.hue_margin
+        if high - low >= 179: # every hue, so there is nothing to wrap
+            hue = (0, 179)
+        else:
+            hue = ((low - shift) % 180, (high - shift) % 180)
+        saturation = self.percentiles(self.saturation, self.low, self.high)
+        value = self.percentiles(self.value, self.low, self.high)
+        lower = np.array([hue[0], max(saturation[0] - self.margin, self.min_saturation), max(value[0] - self.margin, self.min_value)])
+        upper = np.array([hue[1], min(saturation[1] + self.margin, 255), min(value[1] + self.margin, 255)])
+        return lower, upper
@@ -0,0 +1,111 @@
+import numpy as np
+import cv2
+
+class Canvas:
+    """
+    A layer that holds everything that has been drawn so far. Lines and shapes are
+    drawn onto it once, when they are added, and the whole layer is then put on top
+    of each camera frame in one step. That way showing a frame doesn't get slower
+    the more has been drawn.
+    """
+    def __init__(self):
+        self.image = None # the colors of everything drawn
+        self.mask = None # 1 where something has been drawn, 0 everywhere else
+        self.offset = (0,0) # where the top left corner is, if this is just part of a bigger canvas
+
+    def fit(self, frame):
+        """
+        Makes sure the canvas is the same size as the frame. Returns True if the canvas
+        had to be made again, which means everything needs to be redrawn onto it.
+        """
+        if self.image is not None and self.image.shape == frame.shape:
+            return False
+        self.image = np.zeros(frame.shape, np.uint8)
+        self.mask = np.zeros(frame.shape[0:2], np.uint8)
+        return True
+
+    def clear(self):
+        """
+        Wipes everything off of the canvas.
+        """
+        if self.image is not None:
+            self.image[:] = 0
+            self.mask[:] = 0
+
+    def crop(self, x1, y1, x2, y2):
+        """
+        Returns a canvas for just the part of this one between two corners. Drawing on it
+        draws on this canvas, but only inside of that box, which makes it quick to fix up
+        a small area.
+        """
+        region = Canvas()
+        if self.image is not None:
+            x1, y1 = max(int(x1), 0), max(int(y1), 0)
+            x2, y2 = min(int(x2), self.image.shape[1]), min(int(y2), self.image.shape[0])
+            region.image = self.image[y1:max(y1, y2), x1:max(x1, x2)]
+            region.mask = self.mask[y1:max(y1, y2), x1:max(x1, x2)]
+            region.offset = (x1, y1)
+        return region
+
+    def blank(self, x1, y1, x2, y2):
+        """
+        Returns a new, empty canvas for the part of this one between two corners. Nothing
+        drawn on it shows up on this canvas until it is pasted back (see paste).
+        """
+        region = Canvas()
+        if self.image is not None:
+            x1, y1 = max(int(x1), 0), max(int(y1), 0)
+            x2, y2 = max(min(int(x2), self.image.shape[1]), x1), max(min(int(y2), self.image.shape[0]), y1)
+            region.image = np.zeros((y2 - y1, x2 - x1) + self.image.shape[2:], np.uint8)
+            region.mask = np.zeros((y2 - y1, x2 - x1), np.uint8)
+            region.offset = (x1, y1)
+        return region
+
+    def paste(self, region, x1, y1, x2, y2):
+        """
+        Copies what is between two corners from a canvas made by blank onto this one. The
+        box has to be inside of the one the canvas was made for.
+        """
+        if self.image is not None:
+            target = self.crop(x1, y1, x2, y2)
+            (x, y), (height, width) = target.offset, target.mask.shape
+            x, y = x - region.offset[0], y - region.offset[1]
+            target.image[:] = region.image[y:y + height, x:x + width]
+            target.mask[:] = region.mask[y:y + height, x:x + width]
+
+    def shift(self, point):
+        return (int(point[0]) - self.offset[0], int(point[1]) - self.offset[1])
+
+    def draw_line(self, start, end, color, thickness):
+        if self.image is not None:
+            start, end = self.shift(start), self.shift(end)
+            cv2.line(self.image, start, end, color, thickness)
+            cv2.line(self.mask, start, end, 1, thickness)
+
+    def draw_polyline(self, points, color, thickness):
+        """
+        Draws lines through an (n, 2) array of points, one after another.
+        """
+        if self.image is not None:
+            points = [(points - self.offset).astype(np.int32)]
+            cv2.polylines(self.image, points, False, color, thickness)
+            cv2.polylines(self.mask, points, False, 1, thickness)
+
+    def draw_rectangle(self, corner_1, corner_2, color, thickness):
+        if self.image is not None:
+            corner_1, corner_2 = self.shift(corner_1), self.shift(corner_2)
+            cv2.rectangle(self.image, corner_1, corner_2, color, thickness)
+            cv2.rectangle(self.mask, corner_1, corner_2, 1, thickness)
+
+    def draw_circle(self, center, radius, color, thickness):
+        if self.image is not None:
+            center = self.shift(center)
+            cv2.circle(self.image, center, radius, color, thickness)
+            cv2.circle(self.mask, center, radius, 1, thickness)
+
+    def show(self, frame):
+        """
+        Copies everything on the canvas onto the frame, everywhere the mask isn't 0.
+        """
+        if self.image is not None:
+            cv2.copyTo(self.image, self.mask, frame)
@@ -0,0 +1,254 @@
+import numpy as np
+import imutils
+import cv2
+from profiling import NullTimer
+
+def in_range(hsv, lower, upper, dst = None):
+    """
+    Like cv2.inRange on an HSV image, except that the hue can wrap around: if the lower
+    hue is bigger than the upper one, hues from lower up to 179 and from 0 up to upper
+    are both let through, which is how reds (on both sides of 0) are picked out.
+    """
+    if lower[0] <= upper[0]:
+        return cv2.inRange(hsv, lower, upper, dst = dst)
+    high = cv2.inRange(hsv, lower, np.array([179, upper[1], upper[2]]), dst = dst)
+    low = cv2.inRange(hsv, np.array([0, lower[1], lower[2]]), upper)
+    return cv2.bitwise_or(high, low, dst = high)
+
+class ContourBackend:
+    """
+    Finds the largest blob in a mask by tracing the outlines (contours) of every blob,
+    the same way the wand has always been found.
+    """
+    name = 'contours'
+
+    def largest_blob(self, mask):
+        """
+        Returns the center and the radius of the circle around the largest blob in the
+        mask, or None if the mask is empty.
+        """
+        contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours = imutils.grab_contours(contours)
+        if len(contours) == 0:
+            return None
+        largest_contour = max(contours, key=cv2.contourArea)
+        ((x, y), radius) = cv2.minEnclosingCircle(largest_contour)
+        M = cv2.moments(largest_contour)
+        if M["m00"] != 0:
+            center = (int(M["m10"] / M["m00"]), int(M["m01"] / M["m00"]))
+        else:
+            center = (0,0)
+        return center, radius
+
+class ComponentsBackend:
+    """
+    Finds the largest blob in a mask by labeling the connected groups of pixels and
+    looking at their statistics, which OpenCV works out in a single pass.
+    """
+    name = 'components'
+
+    def largest_blob(self, mask):
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity = 8)
+        if count < 2: # label 0 is the background
+            return None
+        largest = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
+        radius = float(max(stats[largest, cv2.CC_STAT_WIDTH], stats[largest, cv2.CC_STAT_HEIGHT])) / 2
+        center = (int(centroids[largest][0]), int(centroids[largest][1]))
+        return center, radius
+
+# All of the ways a Detector can find blobs, by name. Any object with a largest_blob(mask)
+# function can be used as well.
+BACKENDS = {backend.name: backend for backend in (ContourBackend, ComponentsBackend)}
+
+class Track:
+    """
+    Where one wand was last seen and how fast it has been moving, so the detector can
+    guess where it will be in the next frame. The velocity is in pixels per frame, and
+    is smoothed so a single jittery frame doesn't throw the guess off.
+    """
+    smoothing = 0.5
+
+    def __init__(self):
+        self.position = None
+        self.velocity = np.zeros(2)
+        self.misses = 0
+        self.unsearched = False # lost, and the whole frame wasn't searched for it last time
+
+    def predict(self):
+        return self.position + self.velocity
+
+    def update(self, center):
+        center = np.array(center, float)
+        if self.position is not None:
+            self.velocity = self.smoothing * (center - self.position) + (1 - self.smoothing) * self.velocity
+        self.position = center
+        self.misses = 0
+
+    def lose(self):
+        self.position = None
+        self.velocity = np.zeros(2)
+        self.misses = 0
+
+class Detector:
+    """
+    Finds the wands in a frame. The frame is converted to HSV once, and the masks for
+    every color are made from that one conversion. The arrays for the HSV frame and the
+    masks are reused from frame to frame.
+
+    With tracking on, each wand that was found last frame is only looked for in a
+    window around where it is predicted to be, which is much cheaper than searching the
+    whole frame and ignores things of the same color far away. If the wand isn't in its
+    window for more than max_misses frames in a row, the whole frame is searched again,
+    straight away and then only on every search_every frames until it is found, on a
+    copy shrunk by search_scale. The selecting wand is out of sight most of the time, so
+    this saves converting the whole frame to HSV nearly every frame. Blobs with a radius
+    of min_radius or less are too small to be a wand.
+
+    Searches of the whole frame can be done on a copy shrunk by scale (0.5 is half the
+    width and height), since only the middle and size of the wand are needed. The
+    position and radius found are scaled back up to match the full frame, and with
+    refine on the position is then found again at full size in a small window around it.
+    """
+    def __init__(self, backend = 'contours', tracking = False, window = 100, max_misses = 2, min_radius = 30, scale = 1, refine = False, search_every = 3, search_scale = 0.5):
+        self.backend = BACKENDS[backend]() if isinstance(backend, str) else backend
+        self.scale = scale
+        self.refine = refine
+        self.tracking = tracking
+        self.window = window # half the width of the search window when the wand is still
+        self.max_misses = max_misses
+        self.min_radius = min_radius
+        self.search_every = search_every
+        self.search_scale = min(scale, search_scale)
+        self.skipped = 0 # frames since lost wands were last searched for
+        self.tracks = []
+        self.hsv = None
+        self.masks = []
+
+    def to_hsv(self, frame):
+        if self.hsv is None or self.hsv.shape != frame.shape:
+            self.hsv = np.empty_like(frame)
+            self.masks = []
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst = self.hsv)
+
+    def find(self, hsv, lower, upper, index = 0):
+        """
+        Returns the center and radius of the largest blob between the lower and upper
+        colors in an HSV image, or None if there isn't one. index picks which of the
+        reused mask arrays to put the mask in.
+        """
+        while len(self.masks) <= index:
+            self.masks.append(np.empty(hsv.shape[0:2], np.uint8))
+        mask = in_range(hsv, lower, upper, self.masks[index])
+        return self.backend.largest_blob(mask)
+
+    def full_hsv(self, frame, scale = None):
+        """
+        Converts the frame to HSV for searching all of it, shrinking it first by scale
+        (the detector's scale if not given).
+        """
+        scale = self.scale if scale is None else scale
+        if scale != 1:
+            frame = cv2.resize(frame, None, fx = scale, fy = scale, interpolation = cv2.INTER_AREA)
+        return self.to_hsv(frame)
+
+    def find_full(self, frame, hsv, lower, upper, index, scale = None):
+        """
+        Looks for a blob in an HSV image from full_hsv (shrunk by scale), and gives its
+        position and radius in the coordinates of the full size frame.
+        """
+        scale = self.scale if scale is None else scale
+        blob = self.find(hsv, lower, upper, index)
+        if blob is None or scale == 1:
+            return blob
+        center, radius = blob
+        center = (int((center[0] + 0.5) / scale), int((center[1] + 0.5) / scale))
+        radius = radius / scale
+        if self.refine:
+            refined = self.find_in_window(frame, center, int(radius * 1.5) + 8, lower, upper)
+            if refined is not None:
+                return refined
+        return center, radius
+
+    def find_near(self, frame, track, lower, upper):
+        """
+        Looks for a blob only in the window around where the track is predicted to be.
+        The window gets bigger the faster the wand is moving.
+        """
+        return self.find_in_window(frame, track.predict(), int(self.window + 2 * np.abs(track.velocity).max()), lower, upper)
+
+    def find_in_window(self, frame, center, size, lower, upper):
+        """
+        Looks for a blob in the square that reaches size pixels out from center, at the
+        full size of the frame.
+        """
+        x, y = center
+        x1, y1 = max(int(x) - size, 0), max(int(y) - size, 0)
+        x2, y2 = min(int(x) + size, frame.shape[1]), min(int(y) + size, frame.shape[0])
+        if x2 <= x1 or y2 <= y1:
+            return None
+        hsv = cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2HSV)
+        blob = self.backend.largest_blob(in_range(hsv, lower, upper))
+        if blob is None:
+            return None
+        center, radius = blob
+        return (center[0] + x1, center[1] + y1), radius
+
+    def settled(self):
+        """
+        Whether looking at the same frame again would find the same blobs. It wouldn't
+        if a wand was just missed in its window, or a lost one wasn't searched for, since
+        the next look might search the whole frame and find it.
+        """
+        return all(track.misses == 0 and not track.unsearched for track in self.tracks)
+
+    def detect(self, frame, color_ranges, timer = NullTimer()):
+        """
+        Returns the largest blob (or None) for each (lower, upper) pair of colors. The
+        timer is marked after converting to HSV and after looking for each color.
+        """
+        if not self.tracking:
+            hsv = self.full_hsv(frame)
+            timer.mark('detection_hsv')
+            blobs = []
+            for i, (lower, upper) in enumerate(color_ranges):
+                blobs.append(self.find_full(frame, hsv, lower, upper, i))
+                timer.mark('detection_cursor_%d' % (i + 1))
+            return blobs
+
+        while len(self.tracks) < len(color_ranges):
+            self.tracks.append(Track())
+        blobs = [None] * len(color_ranges)
+        lost = [] # colors that need the whole frame searched
+        search = self.skipped + 1 >= self.search_every # whether it is time to look for wands that were already lost
+        for i, (lower, upper) in enumerate(color_ranges):
+            track = self.tracks[i]
+            if track.position is None:
+                lost.append(i)
+                continue
+            blob = self.find_near(frame, track, lower, upper)
+            if blob is not None and blob[1] > self.min_radius:
+                track.update(blob[0])
+                blobs[i] = blob
+            else:
+                blobs[i] = blob # a blob that is too small still counts as seeing something, like without tracking
+                track.misses += 1 # probably hidden for a moment, so keep the track for now
+                if track.misses > self.max_misses:
+                    track.lose()
+                    lost.append(i)
+                    search = True # it only just left its window, so it is probably close by
+            timer.mark('detection_cursor_%d' % (i + 1))
+        if lost and search:
+            self.skipped = 0
+            hsv = self.full_hsv(frame, self.search_scale)
+            timer.mark('detection_hsv')
+            for i in lost:
+                blobs[i] = self.find_full(frame, hsv, color_ranges[i][0], color_ranges[i][1], i, self.search_scale)
+                if blobs[i] is not None and blobs[i][1] > self.min_radius:
+                    self.tracks[i].update(blobs[i][0])
+                self.tracks[i].unsearched = False
+                timer.mark('detection_cursor_%d' % (i + 1))
+        elif lost:
+            self.skipped += 1
+            for i in lost:
+                self.tracks[i].unsearched = True
+        return blobs
@@ -0,0 +1,132 @@
+"""
+Lets a browser draw the strokes itself instead of getting them baked into the video.
+For every processed frame, a client gets a small JSON event with where the cursors are,
+which tool and interface are showing, and only the parts of the drawing that changed
+since the last event it got. The video then only needs to be the camera image, which
+is the same for everyone and only has to be encoded once.
+"""
+import json
+import numpy as np
+from pipeline import run_blocking
+
+CALIBRATION_TOOLS = ('calibration color 1', 'calibration color 2')
+
+def hex_color(color):
+    """
+    Turns a BGR color, the way OpenCV keeps them, into a '#rrggbb' string for the browser.
+    """
+    blue, green, red = (int(channel) for channel in color[0:3])
+    return '#%02x%02x%02x' % (red, green, blue)
+
+def shape_entry(entry):
+    """
+    An entry of rectangle_points or ellipse_points, which is a cursor, a radius or False.
+    """
+    if not entry:
+        return None
+    if isinstance(entry, tuple):
+        return [int(entry[0]), int(entry[1]), hex_color(entry[2]), int(entry[-1])]
+    return int(entry)
+
+def interface(model):
+    """
+    The name of the overlay that is showing, if there is one (see View.show_interface).
+    """
+    if model.tool in CALIBRATION_TOOLS:
+        return None
+    if model.tool in model.overlays:
+        return model.tool
+    return 'draw'
+
+class StrokeEvents:
+    """
+    Remembers what one client has been sent of a model's drawing, so that each event
+    only has to carry what changed: the new points of strokes that grew, whole strokes
+    that are new or were rewritten, strokes that were erased, and new rectangle and
+    circle entries along with the order of the shapes they finish. When the stroke store starts its numbering over (it was cleared or
+    compacted) the client is told to reset and gets everything again.
+    """
+    def __init__(self):
+        self.generation = None
+        self.lengths = np.zeros(0, np.uint32) # how many points of each stroke the client has
+        self.alive = np.zeros(0, bool)
+        self.rectangles = 0 # how many entries of rectangle_points the client has
+        self.ellipses = 0
+
+    def update(self, model):
+        """
+        Returns the next event for the client as a dictionary. The model should not be
+        changing while this runs, so call it with the session's lock held.
+        """
+        event = {'tool': model.tool,
+            'interface': interface(model),
+            'color': hex_color(model.line_color),
+            'pen_size': model.pen_size,
+            'eraser_size': model.eraser_size,
+            'cursors': [[int(cursor[0]), int(cursor[1])] if cursor else None for cursor in (model.cursor_1, model.cursor_2)]}
+        if model.frame is not None:
+            event['size'] = [model.frame.shape[1], model.frame.shape[0]]
+        if model.tool in CALIBRATION_TOOLS and model.elapsed_time < model.calibration_time:
+            event['calibration'] = int(model.calibration_time - model.elapsed_time)
+
+        store = model.strokes
+        if store.generation != self.generation or len(model.rectangle_points) < self.rectangles or len(model.ellipse_points) < self.ellipses:
+            event['reset'] = True
+            self.generation = store.generation
+            self.lengths = np.zeros(0, np.uint32)
+            self.alive = np.zeros(0, bool)
+            self.rectangles = self.ellipses = 0
+
+        count = store.stroke_count
+        lengths = store.strokes['length'][:count].copy()
+        alive = store.strokes['alive'][:count].copy()
+        known_lengths = np.zeros(count, np.uint32)
+        known_alive = np.zeros(count, bool)
+        known_lengths[:len(self.lengths)] = self.lengths
+        known_alive[:len(self.alive)] = self.alive
+
+        strokes = []
+        for stroke in np.flatnonzero(alive & (~known_alive | (lengths != known_lengths))):
+            points = store.stroke_points(stroke)
+            start = int(known_lengths[stroke]) if known_alive[stroke] and lengths[stroke] > known_lengths[stroke] else 0 # a stroke that got shorter was simplified, so it is sent again
+            strokes.append({'id': int(stroke),
+                'from': start,
+                'color': hex_color(store.color(stroke)),
+                'width': int(store.strokes[stroke]['width']),
+                'order': int(store.strokes[stroke]['order']),
+                'points': points[start:].ravel().tolist()})
+        if strokes:
+            event['strokes'] = strokes
+        removed = np.flatnonzero(known_alive & ~alive)
+        if len(removed):
+            event['removed'] = removed.tolist()
+        self.lengths, self.alive = lengths, alive
+
+        known = {'rectangle': self.rectangles, 'ellipse': self.ellipses}
+        if len(model.rectangle_points) > self.rectangles or len(model.ellipse_points) > self.ellipses:
+            event['shape_orders'] = [[kind, i, order] for (kind, i), order in model.shape_orders.items() if i >= known[kind]]
+        if len(model.rectangle_points) > self.rectangles:
+            event['rectangles'] = [shape_entry(entry) for entry in model.rectangle_points[self.rectangles:]]
+            self.rectangles = len(model.rectangle_points)
+        if len(model.ellipse_points) > self.ellipses:
+            event['ellipses'] = [shape_entry(entry) for entry in model.ellipse_points[self.ellipses:]]
+            self.ellipses = len(model.ellipse_points)
+        return event
+
+def update(session, events):
+    with session.lock: # the session's frame might be being processed
+        return events.update(session.model)
+
+def stream(session, pipeline):
+    """
+    Generator of Server-Sent Events for one client, with an event after every frame
+    the session's pipeline processes. A comment is sent when nothing has happened for
+    a while, so the connection doesn't look dead.
+    """
+    events = StrokeEvents()
+    for processed in pipeline.updates():
+        if not processed:
+            yield ': waiting\n\n'
+            continue
+        event = run_blocking(update, session, events)
+        yield 'data: ' + json.dumps(event, separators = (',', ':')) + '\n\n'
@@ -0,0 +1,143 @@
+"""
+Saving drawings. Pressing Save takes a snapshot of the drawing, which is just copies of
+a few arrays, and a worker thread then writes it out as three files:
+
+    drawing-N.png               the drawing on top of the camera picture
+    drawing-N-transparent.png   just the drawing, see-through everywhere else
+    drawing-N.svg               the lines and shapes as vectors, from their points
+
+Encoding the files takes a while for a big drawing, so it happens on the worker and
+never holds up the frames being streamed.
+"""
+import os
+import threading
+import time
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from events import hex_color
+from metrics import stage_seconds
+
+KINDS = {'png': ('.png', 'image/png'),
+    'transparent': ('-transparent.png', 'image/png'),
+    'svg': ('.svg', 'image/svg+xml')}
+
+class Snapshot:
+    """
+    Copies of everything needed to export a model's drawing, taken while the model isn't
+    changing so that the copies can be written out later from another thread.
+    """
+    def __init__(self, model):
+        self.strokes = model.strokes.copy()
+        self.rectangle_points = list(model.rectangle_points)
+        self.ellipse_points = list(model.ellipse_points)
+        self.shape_orders = dict(model.shape_orders)
+        self.frame = model.frame.copy()
+        self.image = model.canvas.image.copy()
+        self.mask = model.canvas.mask.copy()
+
+    def composited(self):
+        frame = self.frame.copy()
+        cv2.copyTo(self.image, self.mask, frame)
+        return frame
+
+    def transparent(self):
+        image = np.zeros((self.image.shape[0], self.image.shape[1], 4), np.uint8)
+        image[:, :, 0:3] = self.image
+        image[:, :, 3] = self.mask * 255
+        return image
+
+    def svg(self):
+        """
+        Returns the drawing as an SVG document, with the lines, rectangles and circles in
+        the order they were drawn, the same as on the canvas.
+        """
+        height, width = self.image.shape[0:2]
+        lines = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" viewBox="0 0 %d %d">' % (width, height, width, height),
+            '<g fill="none" stroke-linecap="round" stroke-linejoin="round">']
+        strokes = self.strokes
+        alive = np.flatnonzero(strokes.strokes['alive'][:strokes.stroke_count])
+        items = [(int(strokes.strokes[stroke]['order']), 'stroke', int(stroke)) for stroke in alive]
+        items += [(order, kind, i) for (kind, i), order in self.shape_orders.items()]
+        for order, kind, i in sorted(items):
+            if kind == 'stroke':
+                coordinates = ' '.join('%d,%d' % (x, y) for x, y in strokes.stroke_points(i).tolist())
+                lines.append('<polyline points="%s" stroke="%s" stroke-width="%d"/>' % (coordinates, hex_color(strokes.color(i)), strokes.strokes[i]['width']))
+            elif kind == 'rectangle':
+                corner_1, corner_2 = self.rectangle_points[i-1], self.rectangle_points[i]
+                x1, x2 = sorted((int(corner_1[0]), int(corner_2[0])))
+                y1, y2 = sorted((int(corner_1[1]), int(corner_2[1])))
+                lines.append('<rect x="%d" y="%d" width="%d" height="%d" stroke="%s" stroke-width="%d"/>' % (x1, y1, x2 - x1, y2 - y1, hex_color(corner_2[2]), corner_2[-1]))
+            else:
+                center, radius = self.ellipse_points[i-1], self.ellipse_points[i]
+                lines.append('<circle cx="%d" cy="%d" r="%d" stroke="%s" stroke-width="%d"/>' % (center[0], center[1], radius, hex_color(center[2]), center[-1]))
+        lines.append('</g>')
+        lines.append('</svg>')
+        return '\n'.join(lines)
+
+def write(path, data):
+    """
+    Writes a file under another name first and then renames it, so nobody can download
+    one that is only half written.
+    """
+    temporary = path + '.part'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+    os.replace(temporary, path)
+
+class Export:
+    """
+    One save of a drawing, which is done once its files are all written. If writing
+    them failed, error is the exception.
+    """
+    def __init__(self, snapshot, directory, number):
+        self.snapshot = snapshot
+        self.directory = directory
+        self.number = number
+        self.paths = {kind: os.path.join(directory, 'drawing-%d%s' % (number, suffix)) for kind, (suffix, mimetype) in KINDS.items()}
+        self.error = None
+        self.finished = threading.Event()
+
+    def run(self):
+        started = time.perf_counter()
+        try:
+            os.makedirs(self.directory, exist_ok = True)
+            snapshot = self.snapshot
+            write(self.paths['png'], cv2.imencode('.png', snapshot.composited())[1].tobytes())
+            write(self.paths['transparent'], cv2.imencode('.png', snapshot.transparent())[1].tobytes())
+            write(self.paths['svg'], snapshot.svg().encode())
+        except Exception as error:
+            self.error = error
+            print('Could not save drawing %d: %r' % (self.number, error))
+        finally:
+            self.snapshot = None # the copies aren't needed anymore
+            self.finished.set()
+            stage_seconds.labels('export').observe(time.perf_counter() - started)
+
+    def done(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout = None):
+        """
+        Waits for the files to be written, and returns whether they were.
+        """
+        return self.finished.wait(timeout) and self.error is None
+
+class Exporter:
+    """
+    Writes exports on its own worker thread, one after another, so saving a lot at once
+    only makes the saves wait for each other.
+    """
+    def __init__(self, max_workers = 1):
+        self.pool = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'export')
+
+    def submit(self, model, directory, number):
+        """
+        Snapshots a model's drawing and starts writing it out. Call it while the model
+        isn't changing. Returns the Export, which finishes later.
+        """
+        export = Export(Snapshot(model), directory, number)
+        self.pool.submit(export.run)
+        return export
+
+exporter = Exporter() # shared by every model, so saves from all of them are written one at a time
@@ -0,0 +1,130 @@
+"""
+Undo and redo. Everything that changes the drawing (a line, an eraser pass, a rectangle
+or circle, clearing) is written down as an action: a (kind, data) tuple with enough in
+it to do the same thing again, see Model.apply. Every few actions, a checkpoint is
+taken of the whole drawing, including the picture on the canvas.
+
+Undoing goes back to the newest checkpoint before the action being undone and does the
+actions since then again, which is never more than interval of them. So undoing takes
+about as long at the start of a session as after hours of drawing. Redoing just does
+the next action again. Checkpoints take up memory, so once they add up to more than
+budget bytes, the oldest ones are thrown away along with the actions before them,
+which can't be undone anymore.
+"""
+import numpy as np
+
+class Checkpoint:
+    """
+    A copy of everything that has been drawn, after position actions.
+    """
+    def __init__(self, model, position):
+        self.position = position
+        self.strokes = model.strokes.copy()
+        self.stroke_grid = model.stroke_grid.copy()
+        self.shape_grid = model.shape_grid.copy()
+        self.shape_orders = dict(model.shape_orders)
+        self.rectangle_points = list(model.rectangle_points)
+        self.ellipse_points = list(model.ellipse_points)
+        canvas = model.canvas
+        self.image = None if canvas.image is None else canvas.image.copy()
+        self.mask = None if canvas.mask is None else canvas.mask.copy()
+        self.nbytes = self.strokes.nbytes + self.stroke_grid.nbytes + self.shape_grid.nbytes + 64 * (len(self.rectangle_points) + len(self.ellipse_points) + len(self.shape_orders))
+        if self.image is not None:
+            self.nbytes += self.image.nbytes + self.mask.nbytes
+
+    def restore(self, model):
+        """
+        Puts the drawing back the way it was. The stroke store gets a new generation, so
+        anything that kept its own copy of the strokes (like a browser) starts over.
+        """
+        generation = model.strokes.generation
+        model.strokes = self.strokes.copy() # the checkpoint may be needed again
+        model.strokes.generation = generation + 1
+        model.stroke_grid = self.stroke_grid.copy()
+        model.shape_grid = self.shape_grid.copy()
+        model.shape_orders = dict(self.shape_orders)
+        model.rectangle_points = list(self.rectangle_points)
+        model.ellipse_points = list(self.ellipse_points)
+        canvas = model.canvas
+        if self.image is not None and canvas.image is not None and self.image.shape == canvas.image.shape:
+            np.copyto(canvas.image, self.image)
+            np.copyto(canvas.mask, self.mask)
+        else: # the frame changed size since then, so the picture is no use
+            model.redraw_canvas()
+
+class History:
+    """
+    The actions done to a model's drawing, and checkpoints to get back to them quickly.
+    Positions count actions from the start of the session, even after old ones are
+    thrown away. The first checkpoint is of the drawing when the history is made.
+    """
+    def __init__(self, model, interval = 8, budget = 32 * 2 ** 20):
+        self.model = model
+        self.interval = interval
+        self.budget = budget
+        self.actions = []
+        self.start = 0 # the position of the first action still in actions
+        self.position = 0 # how many actions have been done, the rest can be redone
+        self.checkpoints = [Checkpoint(model, 0)]
+
+    def end(self):
+        return self.start + len(self.actions)
+
+    def can_undo(self):
+        return self.position > self.checkpoints[0].position
+
+    def can_redo(self):
+        return self.position < self.end()
+
+    def record(self, action):
+        """
+        Adds an action that was just done to the model. Anything that had been undone
+        can't be redone anymore after this.
+        """
+        del self.actions[self.position - self.start:]
+        self.checkpoints = [checkpoint for checkpoint in self.checkpoints if checkpoint.position <= self.position]
+        self.actions.append(action)
+        self.position += 1
+        self.check()
+
+    def check(self):
+        """
+        Takes a checkpoint if it has been interval actions since the last one, then
+        throws away old checkpoints until they fit in the budget.
+        """
+        if self.position - self.checkpoints[-1].position < self.interval:
+            return
+        self.checkpoints.append(Checkpoint(self.model, self.position))
+        while len(self.checkpoints) > 1 and sum(checkpoint.nbytes for checkpoint in self.checkpoints) > self.budget:
+            self.checkpoints.pop(0)
+            first = self.checkpoints[0].position
+            del self.actions[:first - self.start]
+            self.start = first
+
+    def undo(self):
+        """
+        Takes back the last action. Returns False if there is nothing to undo.
+        """
+        if not self.can_undo():
+            return False
+        self.go_to(self.position - 1)
+        return True
+
+    def redo(self):
+        """
+        Does the last action that was undone again. Returns False if there is none.
+        """
+        if not self.can_redo():
+            return False
+        self.model.apply(self.actions[self.position - self.start])
+        self.position += 1
+        if self.checkpoints[-1].position < self.position: # otherwise there are checkpoints from before the undo still ahead
+            self.check()
+        return True
+
+    def go_to(self, position):
+        checkpoint = max((checkpoint for checkpoint in self.checkpoints if checkpoint.position <= position), key = lambda checkpoint: checkpoint.position)
+        checkpoint.restore(self.model)
+        for action in self.actions[checkpoint.position - self.start:position - self.start]:
+            self.model.apply(action)
+        self.position = position
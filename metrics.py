@@ -0,0 +1,210 @@
+"""
+Small, always-on measurements of how the app is doing, which the /metrics page shows in
+the Prometheus text format. Everything here is cheap enough to record for every frame:
+a histogram only adds one to a bucket, and gauges that are expensive to work out are
+only worked out when the page is asked for.
+"""
+import bisect
+import threading
+import time
+
+# upper bounds of the histogram buckets, in seconds
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def format_labels(names, values, extra = ''):
+    labels = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Metric:
+    """
+    A named measurement, which can be split up by labels. labels(...) returns the
+    measurement for one set of label values, making it the first time it is asked for.
+    """
+    kind = None
+
+    def __init__(self, name, help, labelnames = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.labelnames:
+            self.labels() # so that it shows up as 0 before anything happens
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.kind)]
+        for values, child in sorted(self.children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount = 1):
+        with self.lock:
+            self.value += amount
+
+    def render(self, name, labelnames, values):
+        return ['%s%s %s' % (name, format_labels(labelnames, values), format_value(self.value))]
+
+class Counter(Metric):
+    """
+    A count that only goes up, like the number of frames dropped.
+    """
+    kind = 'counter'
+
+    def new_child(self):
+        return CounterValue()
+
+    def inc(self, amount = 1):
+        self.labels().inc(amount)
+
+class GaugeValue:
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """
+        Makes the gauge call function to find its value whenever it is shown.
+        """
+        self.function = function
+
+    def render(self, name, labelnames, values):
+        value = self.function() if self.function else self.value
+        return ['%s%s %s' % (name, format_labels(labelnames, values), format_value(value))]
+
+class Gauge(Metric):
+    """
+    A value that can go up and down, like the number of clients watching.
+    """
+    kind = 'gauge'
+
+    def new_child(self):
+        return GaugeValue()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is for everything bigger than all the buckets
+        self.sum = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def render(self, name, labelnames, values):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('%s_bucket%s %d' % (name, format_labels(labelnames, values, 'le="%s"' % le), cumulative))
+        lines.append('%s_sum%s %s' % (name, format_labels(labelnames, values), repr(float(total))))
+        lines.append('%s_count%s %d' % (name, format_labels(labelnames, values), cumulative))
+        return lines
+
+class Histogram(Metric):
+    """
+    Counts how many measurements fall into each of a fixed set of buckets, so it uses
+    the same small amount of memory no matter how many measurements there are.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames = (), buckets = TIME_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+class Registry:
+    """
+    All of the metrics that get shown on the metrics page.
+    """
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames = ()):
+        return self.add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames = ()):
+        return self.add(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames = (), buckets = TIME_BUCKETS):
+        return self.add(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+class MetricsTimer:
+    """
+    A timer for process_frame (see profiling.StageTimer) that puts how long each stage
+    took into a histogram labeled by stage, instead of keeping every time.
+    """
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.last = time.perf_counter()
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.histogram.labels(stage).observe(now - self.last)
+        self.last = now
+
+registry = Registry()
+
+stage_seconds = registry.histogram('cvpaint_stage_seconds', 'Time spent in each stage of getting a frame to a client.', ['stage'])
+dropped_frames = registry.counter('cvpaint_dropped_frames_total', 'Frames skipped because a later stage or a client was still busy with an earlier one.')
+still_frames = registry.counter('cvpaint_still_frames_total', 'Camera frames skipped because nothing in them had moved.')
+degraded_pipelines = registry.gauge('cvpaint_degraded_pipelines', 'Pipelines running with lower quality settings than the best, to keep up (see qos.py).')
+camera_thread_starts = registry.counter('cvpaint_camera_thread_starts_total', 'Times the camera thread has been started, including restarts after it stopped.')
+camera_reconnects = registry.counter('cvpaint_camera_reconnects_total', 'Times a camera stopped giving frames and had to be opened again.')
+active_clients = registry.gauge('cvpaint_active_clients', 'Clients currently watching a video feed or following the events of one.')
+active_sessions = registry.gauge('cvpaint_active_sessions', 'Drawing sessions currently kept in memory.')
+stroke_points = registry.gauge('cvpaint_stroke_points', 'Stroke points held by all sessions.')
+stroke_bytes = registry.gauge('cvpaint_stroke_bytes', 'Bytes used to store the strokes of all sessions.')
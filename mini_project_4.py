@@ -2,7 +2,17 @@ import numpy as np
 import time
 import imutils
 import os
+from collections import deque
 from buttons import *
+from canvas import Canvas
+from detection import Detector
+from spatial import StrokeGrid, cut_circle, simplify
+from strokes import StrokeStore, StrokeFilter
+from calibration import Calibration
+from history import History
+import export
+from profiling import NullTimer
+from motion import MotionGate
 import cv2
 
 class Model:
@@ -20,10 +30,34 @@ class Model:
         self.calibration_start = 0
         self.elapsed_time = 0
         self.calibration_time = 6
+        self.calibration = Calibration() # collects the colors held up while calibrating
+        self.clock = time.time # where the time comes from, which can be swapped out to run faster than real time
+        self.timer = NullTimer() # swapped for a profiling.StageTimer to time each part of process_frame
+        self.motion = MotionGate() # notices when nothing has moved, so process_frame can skip the frame
+        self.output = None # the last frame process_frame finished, with everything drawn on it
+        self.output_tool = None # what the tool was once that frame was finished
+        self.output_pressed = False # whether buttons were pressed in that frame, which may have left something for the next frame to do
+        self.detect_every = 1 # look for the wands on only every this many frames, to save time when the computer is busy
+        self.frame_count = 0
+        self.recorder = None # a recording.Recorder to write down what happens in every frame, if there is one
+        self.pressed_buttons = [] # the buttons pressed during the frame being processed
         self.current_path = os.path.dirname(__file__)
-        self.line_points = []
+        self.strokes = StrokeStore() # every line that has been drawn
+        self.stroke_filter = StrokeFilter() # cleans up wand positions before they go into strokes
         self.rectangle_points = []
         self.ellipse_points = []
+        self.canvas = Canvas() # everything that has been drawn so far, kept as an image
+        self.stroke_grid = StrokeGrid() # where the strokes are, for the eraser to find them
+        self.shape_grid = StrokeGrid() # where the rectangles and circles are, as ('rectangle' or 'ellipse', index of their last entry)
+        self.shape_orders = {} # the order each of those was drawn in, counted along with the strokes
+        self.chunk_points = 128 # lines are kept as strokes of at most this many points, so erasing part of a long line only touches the pieces near the eraser
+        self.line_start = None # the first stroke of the line being drawn
+        self.erased = [] # the (center, radius) of each time the eraser cut something since it started touching lines
+        self.history = History(self) # for undo and redo
+        self.exporter = export.exporter # writes saved drawings out in the background
+        self.export_directory = os.path.join(self.current_path, 'Drawings')
+        self.export_count = 0
+        self.last_export = None # the newest export.Export
         self.cursor_1 = ()
         self.cursor_2 = ()
         self.pen_size = 7
@@ -35,13 +69,16 @@ class Model:
         # All the buttons in the interface initialized here.
 
         self.clear = Clear_Button(20,20,'Clear.png',50, self)
-        self.erase = Erase_Button(160,20,'Erase.png',50, self)
-        self.pen = Pen_Button(90,20,'Pen.png',50,self)
-        self.thicknessess = Thicknessess_Button(230,20,'Thickness.png',50, self, self.pen_size)
-        self.color = Color_Button(300,20,'Color.png',50, self)
-        self.rectangle = Rectangle_Button(370,20,'Rectangle.png',50,self)
-        self.ellipse = Ellipse_Button(440,20,'Ellipse.png',50,self)
-        self.calibrate = Calibration_Button(510,20,'Calibrate.png',50, self)
+        self.pen = Pen_Button(76,20,'Pen.png',50,self)
+        self.erase = Erase_Button(132,20,'Erase.png',50, self)
+        self.thicknessess = Thicknessess_Button(188,20,'Thickness.png',50, self, self.pen_size)
+        self.color = Color_Button(244,20,'Color.png',50, self)
+        self.rectangle = Rectangle_Button(300,20,'Rectangle.png',50,self)
+        self.ellipse = Ellipse_Button(356,20,'Ellipse.png',50,self)
+        self.undo_button = Undo_Button(412,20,'Undo.png',50,self)
+        self.redo_button = Redo_Button(468,20,'Redo.png',50,self)
+        self.save = Save_Button(524,20,'Save.png',50,self)
+        self.calibrate = Calibration_Button(580,20,'Calibrate.png',50, self)
 
         self.draw_thin = Thickness_Button(160,200,'Thin.png',50,self,2)
         self.draw_medium = Thickness_Button(300,200,'Medium.png',50,self,7)
@@ -49,6 +86,282 @@ class Model:
         self.color_slider = Color_Slider(40,205,"ColorBar.png",42,500,self)
         self.color_choice = Color_Choice(540,200, 'Check.png', 50, self)
 
+        # Each set of buttons is drawn once into an overlay, which is what actually gets shown.
+
+        self.overlays = {
+            'draw': Overlay([self.clear, self.thicknessess, self.color, self.erase, self.calibrate, self.pen, self.ellipse, self.rectangle, self.undo_button, self.redo_button, self.save], self, band = (0,90)),
+            'thickness': Overlay([self.draw_thin, self.draw_medium, self.draw_thick], self, band = (200,250)),
+            'color_slider': Overlay([self.color_slider, self.color_choice], self)}
+
+    def add_line_point(self, point):
+        """
+        Adds a cursor to the line being drawn, and draws the segment from the last point
+        to it onto the canvas. Points go through the stroke filter first, which may drop
+        them. A cursor that is False or None (the wand wasn't found) ends the line, so
+        the next point starts a new one.
+        """
+        if not point:
+            self.end_line()
+            self.stroke_filter.reset()
+            return
+        position = self.stroke_filter.add(point[0], point[1], self.clock())
+        if position is None:
+            return
+        if self.stroke_filter.jumped:
+            self.end_line()
+        if self.strokes.open_stroke is None:
+            self.line_start = self.strokes.stroke_count
+        last = self.strokes.last_point()
+        stroke = self.strokes.append(position[0], position[1], point[2], point[-1])
+        if last is not None:
+            self.canvas.draw_line(last, position, point[2], point[-1])
+            self.stroke_grid.add_segment(stroke, last, position, point[-1])
+        if self.strokes.strokes[stroke]['length'] >= self.chunk_points:
+            self.simplify_open_stroke()
+            self.strokes.split_open()
+
+    def end_line(self):
+        """
+        Ends the line being drawn, first simplifying it (see simplify_open_stroke). The
+        finished line, which may be several strokes, goes into the history.
+        """
+        stroke = self.strokes.open_stroke
+        if stroke is None:
+            return
+        self.simplify_open_stroke()
+        self.strokes.end_stroke()
+        self.record('line', [(self.strokes.stroke_points(stroke), self.strokes.color(stroke), int(self.strokes.strokes[stroke]['width'])) for stroke in range(self.line_start, self.strokes.stroke_count)])
+        self.line_start = None
+
+    def simplify_open_stroke(self):
+        """
+        Simplifies the open stroke to the fewest points that keep its shape, and redraws
+        the part of the canvas it covers to match.
+        """
+        stroke = self.strokes.open_stroke
+        points = self.strokes.stroke_points(stroke)
+        simplified = simplify(points, self.stroke_filter.tolerance)
+        if len(simplified) < len(points):
+            width = int(self.strokes.strokes[stroke]['width'])
+            self.stroke_grid.remove(stroke, points, width)
+            self.strokes.replace_open_points(simplified)
+            self.stroke_grid.add(stroke, simplified, width)
+            reach = width // 2 + 2
+            (x1, y1), (x2, y2) = points.min(axis = 0), points.max(axis = 0)
+            self.redraw_canvas((x1 - reach, y1 - reach, x2 + reach + 1, y2 + reach + 1))
+
+    def add_stroke(self, points, color, width, order = None):
+        """
+        Adds a whole stroke from an array of points, with a color index from the palette,
+        to the store and the grid, split into strokes of at most chunk_points. It isn't
+        drawn onto the canvas.
+        """
+        for start in range(0, max(len(points) - 1, 1), self.chunk_points - 1): # each piece starts where the last one ended
+            piece = points[start:start + self.chunk_points]
+            self.stroke_grid.add(self.strokes.add_stroke(piece, color, width, order), piece, width)
+
+    def add_rectangle_point(self, point):
+        """
+        Adds a corner to rectangle_points. If it finishes a rectangle, the rectangle is
+        drawn onto the canvas.
+        """
+        if point and self.rectangle_points and self.rectangle_points[-1]:
+            self.canvas.draw_rectangle(self.rectangle_points[-1][0:2], point[0:2], point[2], point[-1])
+            (x1, y1), (x2, y2) = self.rectangle_points[-1][0:2], point[0:2]
+            self.shape_grid.add(('rectangle', len(self.rectangle_points)), np.array([(x1, y1), (x2, y1), (x2, y2), (x1, y2), (x1, y1)]), point[-1])
+            self.shape_orders[('rectangle', len(self.rectangle_points))] = self.strokes.take_order()
+        self.rectangle_points.append(point)
+
+    def add_ellipse_radius(self, radius):
+        """
+        Adds a radius to ellipse_points after its center, which finishes the circle, and
+        draws it onto the canvas.
+        """
+        center = self.ellipse_points[-1]
+        if radius and center:
+            self.canvas.draw_circle(center[0:2], radius, center[2], center[-1])
+            outline = cv2.ellipse2Poly((int(center[0]), int(center[1])), (radius, radius), 0, 0, 360, 10)
+            self.shape_grid.add(('ellipse', len(self.ellipse_points)), outline, center[-1])
+            self.shape_orders[('ellipse', len(self.ellipse_points))] = self.strokes.take_order()
+        self.ellipse_points.append(radius)
+
+    def redraw_canvas(self, region = None):
+        """
+        Clears the canvas and draws everything onto it again. This only needs to happen
+        when the frame changes size. region can be the (x1, y1, x2, y2) corners of a box,
+        in which case only that part of the canvas is cleared and redrawn, with just the
+        strokes and shapes the grids say are near it. That is drawn on a blank canvas a
+        little bigger than the box and then pasted in, since OpenCV draws thick lines a bit
+        differently where they get cut off at the edge of what they're drawn on. Either
+        way, strokes and shapes are drawn in the order they were drawn the first time, so
+        where they cross the pixels come out the same.
+        """
+        if region is None:
+            canvas = self.canvas
+            canvas.clear()
+            strokes = np.flatnonzero(self.strokes.strokes['alive'][:self.strokes.stroke_count])
+            shapes = self.shape_orders
+        else:
+            x1, y1, x2, y2 = region
+            margin = 16 # more than half of the thickest line
+            canvas = self.canvas.blank(x1 - margin, y1 - margin, x2 + margin, y2 + margin)
+            strokes = self.stroke_grid.near(*region)
+            shapes = self.shape_grid.near(*region)
+        for order, kind, i in self.draw_order(strokes, shapes):
+            if kind == 'stroke':
+                canvas.draw_polyline(self.strokes.stroke_points(i), self.strokes.color(i), int(self.strokes.strokes[i]['width']))
+            elif kind == 'rectangle':
+                canvas.draw_rectangle(self.rectangle_points[i-1][0:2], self.rectangle_points[i][0:2], self.rectangle_points[i][2], self.rectangle_points[i][-1])
+            else:
+                canvas.draw_circle(self.ellipse_points[i-1][0:2], self.ellipse_points[i], self.ellipse_points[i-1][2], self.ellipse_points[i-1][-1])
+        if region is not None:
+            self.canvas.paste(canvas, *region)
+
+    def draw_order(self, strokes, shapes):
+        """
+        Puts strokes that are still alive and ('rectangle' or 'ellipse', index) shapes
+        together in the order they were drawn, as a list of (order, kind, index) with
+        'stroke' as the kind of strokes.
+        """
+        orders = self.strokes.strokes['order']
+        alive = self.strokes.strokes['alive']
+        items = [(int(orders[stroke]), 'stroke', int(stroke)) for stroke in strokes if alive[stroke]]
+        items += [(self.shape_orders[shape], shape[0], shape[1]) for shape in shapes]
+        items.sort()
+        return items
+
+    def erase_lines(self, center, radius, compact = True):
+        """
+        Cuts everything within radius of center out of the lines that have been drawn.
+        Lines that go through the circle are split in two. Only strokes near the eraser
+        are looked at, and only the part of the canvas around it is redrawn. Returns
+        whether anything was erased. Once erased strokes take up more room than the rest,
+        they are compacted away, unless compact is False.
+        """
+        x, y = center
+        widest = 0
+        for stroke in self.stroke_grid.near(x - radius, y - radius, x + radius, y + radius):
+            points = self.strokes.stroke_points(stroke)
+            width = int(self.strokes.strokes[stroke]['width'])
+            pieces = cut_circle(points, center, radius + width / 2) # erase the whole width of the line
+            if pieces is not None:
+                color, order = self.strokes.strokes[stroke]['color'], self.strokes.strokes[stroke]['order']
+                self.stroke_grid.remove(stroke, points, width)
+                self.strokes.remove_stroke(stroke)
+                for piece in pieces:
+                    self.add_stroke(piece, color, width, order)
+                widest = max(widest, width)
+        if widest:
+            reach = radius + widest + 1
+            self.redraw_canvas((x - reach, y - reach, x + reach + 1, y + reach + 1))
+            if compact and self.strokes.dead_points() > max(len(self.strokes), 4096):
+                self.compact_strokes()
+        return widest > 0
+
+    def erase_at(self, center, radius):
+        """
+        Erases around center, and remembers where for the history if anything was erased.
+        """
+        if self.erase_lines(center, radius):
+            self.erased.append(((int(center[0]), int(center[1])), radius))
+
+    def end_erase(self):
+        """
+        Puts everything erased since the eraser started touching lines into the history,
+        as one action.
+        """
+        if self.erased:
+            self.record('erase', self.erased)
+            self.erased = []
+
+    def cancel_shape(self):
+        """
+        Throws away the first corner or center of a rectangle or circle that hasn't been
+        finished.
+        """
+        if self.tool == 'rectangle_2':
+            self.rectangle_points.pop()
+            self.tool = 'rectangle_1'
+        elif self.tool == 'circle_2':
+            self.ellipse_points.pop()
+            self.tool = 'circle_1'
+
+    def finish(self):
+        """
+        Finishes whatever is being drawn, so that it is in the history as a whole.
+        """
+        self.end_line()
+        self.stroke_filter.reset()
+        self.end_erase()
+        self.cancel_shape()
+
+    def clear_drawing(self):
+        """
+        Wipes out every line and shape.
+        """
+        self.strokes.clear()
+        self.stroke_filter.reset()
+        self.rectangle_points.clear()
+        self.ellipse_points.clear()
+        self.stroke_grid.clear()
+        self.shape_grid.clear()
+        self.shape_orders.clear()
+        self.canvas.clear()
+
+    def save_drawing(self):
+        """
+        Saves the drawing as a PNG on top of the current frame, a see-through PNG and an
+        SVG, in export_directory. Only copies are made here, and the files are written
+        in the background (see export.py).
+        """
+        self.export_count += 1
+        self.last_export = self.exporter.submit(self, self.export_directory, self.export_count)
+
+    def record(self, kind, data):
+        self.history.record((kind, data))
+
+    def apply(self, action):
+        """
+        Does an action from the history (see history.py) again, the same way it was done
+        the first time.
+        """
+        kind, data = action
+        if kind == 'line':
+            for points, color, width in data:
+                self.add_stroke(points, self.strokes.color_index(color), width)
+                self.canvas.draw_polyline(points, color, width)
+            self.strokes.end_stroke()
+        elif kind == 'erase':
+            for center, radius in data:
+                self.erase_lines(center, radius, compact = False) # compacting takes a while, and can wait for the next time something is erased
+        elif kind == 'rectangle':
+            for point in data:
+                self.add_rectangle_point(point)
+        elif kind == 'ellipse':
+            self.ellipse_points.append(data[0])
+            self.add_ellipse_radius(data[1])
+            self.ellipse_points.append(data[2])
+        elif kind == 'clear':
+            self.clear_drawing()
+
+    def undo(self):
+        self.finish()
+        self.history.undo()
+
+    def redo(self):
+        self.finish()
+        self.history.redo()
+
+    def compact_strokes(self):
+        """
+        Frees the space used by erased strokes, and sorts the strokes that are left back
+        into the grid under their new numbers.
+        """
+        self.strokes.compact()
+        self.stroke_grid.clear()
+        for stroke, points, color, width in self.strokes:
+            self.stroke_grid.add(stroke, points, width)
+
     def check_buttons(self, cursor):
         """
         Just tells all of the buttons currently displayed to check if the cursor
@@ -70,30 +383,53 @@ class Model:
             self.erase.check_pressed(cursor)
             self.calibrate.check_pressed(cursor)
             self.pen.check_pressed(cursor)
+            self.undo_button.check_pressed(cursor)
+            self.redo_button.check_pressed(cursor)
+            self.save.check_pressed(cursor)
 
 class Controller:
     """
     A class to detect input from the user of the program. It takes the model as input, and has a
-    function to return the position of an object of the color from the calibration step
+    function to return the position of an object of the color from the calibration step.
+    Any keyword arguments (like backend, the name of the way blobs are found, or
+    tracking) are passed on to the Detector.
     """
-    def __init__(self, model):
+    def __init__(self, model, **detection):
         self.model = model
+        self.detector = Detector(**detection)
 
     def check_distance(self, point):
         """
-        Checks if a point is within a certain distance of the last point in line_points.
+        Checks how far a point is from the last point of the line being drawn.
         This gets rid of false positives far away from where the cursor was last frame.
         """
-        if self.model.line_points:
-            if self.model.line_points[-1]:
-                x1 = point[0]
-                y1 = point[1]
-                x2 = self.model.line_points[-1][0]
-                y2 = self.model.line_points[-1][1]
-                distance = np.sqrt((x2-x1)**2 + (y2-y1)**2)
-                return distance
-        else:
+        last = self.model.strokes.last_point()
+        if last is None:
             return 0
+        return np.sqrt((last[0]-point[0])**2 + (last[1]-point[1])**2)
+
+    def make_cursor(self, blob):
+        """
+        Turns a blob found by the detector into a cursor: a tuple of where it is, the
+        current color and thickness, and how fast it is moving. Blobs that are too
+        small to be the wand give False.
+        """
+        if blob is None:
+            return None
+        center, radius = blob
+        if radius > self.detector.min_radius:
+            velocity = self.check_distance(center)
+            return((center[0], center[1],self.model.line_color, velocity,self.model.pen_size)) #Tuple where line info is stored)
+        else:
+            return False
+
+    def detect_wands(self):
+        """
+        Looks at the current frame and returns both cursors at once, from the largest
+        blob of each calibrated color.
+        """
+        blobs = self.detector.detect(self.model.frame, [(self.model.lower_color_1, self.model.upper_color_1), (self.model.lower_color_2, self.model.upper_color_2)], self.model.timer)
+        return [self.make_cursor(blob) for blob in blobs]
 
     def detect_wand(self, lower, upper):
         """
@@ -101,29 +437,29 @@ class Controller:
         and returns the center of that point, as well as the current color and
         velocity of the cursor.
         """
-        kernel = np.ones((15, 15), 'uint8') # make a kernel for blurring
-        blurred = cv2.GaussianBlur(self.model.frame, (17, 17), 0)
-        blurred = cv2.dilate(self.model.frame, kernel) # blur the frame to average out the value in the circle
-        hsv_frame = cv2.cvtColor(self.model.frame, cv2.COLOR_BGR2HSV)
-        mask = cv2.inRange(hsv_frame, lower, upper)
-        contours = cv2.findContours(mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        contours = imutils.grab_contours(contours)
-        center = None
-
-        if len(contours) > 0:
-            largest_contour = max(contours, key=cv2.contourArea)
-            ((x, y), radius) = cv2.minEnclosingCircle(largest_contour)
-            M = cv2.moments(largest_contour)
-            if M["m00"] != 0:
-                center = (int(M["m10"] / M["m00"]), int(M["m01"] / M["m00"]))
-            else:
-                center = (0,0)
+        hsv_frame = self.detector.to_hsv(self.model.frame)
+        return self.make_cursor(self.detector.find(hsv_frame, lower, upper))
 
-            if radius > 30:
-                velocity = self.check_distance(center)
-                return((center[0], center[1],self.model.line_color, velocity,self.model.pen_size)) #Tuple where line info is stored)
-            else:
-                return False
+class ReplayController(Controller):
+    """
+    A Controller that hands back wands that were found earlier instead of looking at the
+    frame. Each frame's wands are given to add before the frame is processed. Normally
+    they are cursors, which are used as they are. With blobs, they are what the detector
+    found, and are made into cursors from the model as it is now, like detect_wands does.
+    """
+    def __init__(self, model, blobs = False, **detection):
+        Controller.__init__(self, model, **detection)
+        self.blobs = blobs
+        self.waiting = deque()
+
+    def add(self, wands):
+        self.waiting.append(wands)
+
+    def detect_wands(self):
+        wands = self.waiting.popleft()
+        if self.blobs:
+            return [self.make_cursor(blob) for blob in wands]
+        return list(wands)
 
 class View:
     """
@@ -134,74 +470,33 @@ class View:
     def __init__(self, model):
         self.model = model
 
-    def show_lines(self):
-        """
-        Iterates through all the points in the list of where the target has been
-        and draws lines between them.
-        """
-        for i in range(len(self.model.line_points)):
-            if i > 0 and self.model.line_points[i-1] and self.model.line_points[i]: # make sure both endpoints exist
-                #if points[i][3] < 100: # check the velocity of the target to filter out false positives
-                cv2.line(self.model.frame, self.model.line_points[i-1][0:2], self.model.line_points[i][0:2], self.model.line_points[i][2], self.model.line_points[i][-1])
-
-    def show_rectangles(self):
-        """
-        Iterates through all the points in the list of where the target has been
-        and draws rectangles between them.
-        """
-        for i in range(len(self.model.rectangle_points)):
-            if i > 0 and self.model.rectangle_points[i-1] and self.model.rectangle_points[i]: # make sure both endpoints exist
-                #if points[i][3] < 100: # check the velocity of the target to filter out false positives
-                cv2.rectangle(self.model.frame, self.model.rectangle_points[i-1][0:2], self.model.rectangle_points[i][0:2], self.model.rectangle_points[i][2], self.model.rectangle_points[i][-1])
-
-    def show_circles(self):
+    def show_drawing(self):
         """
-        Iterates through all tfhe points in the list of where the target has been
-        and draws ellipses between them.
+        Puts everything that has been drawn (lines, rectangles and circles) on top of
+        the frame. They are already drawn on the canvas, so this takes the same amount
+        of time no matter how much has been drawn.
         """
-        for i in range(len(self.model.ellipse_points)):
-            if i > 0 and self.model.ellipse_points[i-1] and self.model.ellipse_points[i]: # make sure both endpoints exist
-                if self.model.ellipse_points[i-1][2]:
-                    cv2.circle(self.model.frame, self.model.ellipse_points[i-1][0:2], self.model.ellipse_points[i], self.model.ellipse_points[i-1][2], self.model.ellipse_points[i-1][-1])
+        self.model.canvas.show(self.model.frame)
 
     def remove_lines(self):
         """
-        This is the function called by the eraser tool. It erases lines by removing points
-        from the line_points list if they are within a certain distance from the cursor.
+        This is the function called by the eraser tool. It erases the parts of lines
+        that are within eraser_size of the cursor.
         """
-        if self.model.cursor_1 and self.model.line_points:
-            eraser_range_x = [i for i in range(int(self.model.cursor_1[0])-self.model.eraser_size, int(self.model.cursor_1[0])+self.model.eraser_size)]
-            eraser_range_y = [i for i in range(int(self.model.cursor_1[1])-self.model.eraser_size, int(self.model.cursor_1[1])+self.model.eraser_size)]
-            for i in range(len(self.model.line_points)):
-                if self.model.line_points[i]:
-                    if self.model.line_points[i][0] in eraser_range_x and self.model.line_points[i][1] in eraser_range_y:
-                        self.model.line_points[i] = False
-
+        if self.model.cursor_1:
+            self.model.erase_at(self.model.cursor_1[0:2], self.model.eraser_size)
+        else:
+            self.model.end_erase() # the eraser was lifted, so that was one pass
 
     def show_interface(self):
         """
-        Calls the display function of all the buttons currently in the interface
+        Shows the overlay with all the buttons currently in the interface
         """
         if self.model.tool != 'calibration color 1' and self.model.tool != 'calibration color 2':
-            if self.model.tool == 'thickness':
-                cv2.rectangle(self.model.frame,(0,250),(self.model.frame.shape[1],200),(255,255,255),-1)
-                self.model.draw_thin.display(self.model.frame)
-                self.model.draw_medium.display(self.model.frame)
-                self.model.draw_thick.display(self.model.frame)
-            elif self.model.tool == 'color_slider':
-                self.model.color_slider.display(self.model.frame)
-                self.model.color_choice.display(self.model.frame)
+            if self.model.tool == 'thickness' or self.model.tool == 'color_slider':
+                self.model.overlays[self.model.tool].display(self.model.frame)
             else:
-                cv2.rectangle(self.model.frame,(0,0),(self.model.frame.shape[1],90),(255,255,255),-1)
-                self.model.clear.display(self.model.frame)
-                self.model.thicknessess.display(self.model.frame)
-                self.model.color.display(self.model.frame)
-                self.model.erase.display(self.model.frame)
-                self.model.calibrate.display(self.model.frame)
-                self.model.color.display(self.model.frame)
-                self.model.pen.display(self.model.frame)
-                self.model.ellipse.display(self.model.frame)
-                self.model.rectangle.display(self.model.frame)
+                self.model.overlays['draw'].display(self.model.frame)
 
     def show_cursor(self):
         """
@@ -219,53 +514,96 @@ class View:
             if self.model.cursor_2: #selecting cursor
                 cv2.circle(self.model.frame, ((self.model.cursor_2[0]),(self.model.cursor_2[1])),self.model.pen_size,self.model.line_color, thickness = 2)
 
+ACTION_TOOLS = ('save', 'calibration color 1', 'calibration color 2') # tools that do something on the next frame whether anything moves or not
+
+def can_reuse_output(model, controller):
+    """
+    Whether the last frame process_frame finished would come out the same if nothing in
+    front of the camera has moved. It wouldn't while a tool has something to do anyway,
+    like saving or calibrating (which counts down), or right after the tool changed or a
+    button was pressed, or if the detector isn't done looking for a wand.
+    """
+    return model.output is not None and model.output.shape == model.frame.shape and model.tool == model.output_tool \
+        and model.tool not in ACTION_TOOLS and not model.output_pressed and controller.detector.settled()
+
 def process_frame(model, controller, view):
     """
     This function finds the cursors, executes what current tool needs to happen,
     shows all the buttons, and draws on the frame.
+
+    If nothing has moved since the last frame (see motion.MotionGate), the cursors and
+    everything else would come out the same, so the last finished frame is used again
+    instead.
+
+    If the model has a recorder, what happened in the frame is written down, so it can
+    be played back later without the camera (see recording.py).
     """
+    model.timer.start()
+    model.pressed_buttons.clear()
+    if can_reuse_output(model, controller) and model.motion.still(model.frame):
+        model.frame = model.output
+        model.timer.mark('motion')
+        if model.recorder is not None:
+            model.recorder.add(model, still = True)
+        return
+    model.timer.mark('motion')
     model.frame = cv2.flip(model.frame,1) # reverse the frame so people aren't confused
-    model.cursor_1 = controller.detect_wand(model.lower_color_1, model.upper_color_1) # find both cursors
-    model.cursor_2 = controller.detect_wand(model.lower_color_2, model.upper_color_2)
+    if model.canvas.fit(model.frame): # the canvas is new, so everything needs to go back on it
+        model.redraw_canvas()
+    model.timer.mark('mirror')
+    model.frame_count += 1
+    detected = model.frame_count % model.detect_every == 0
+    if detected:
+        model.cursor_1, model.cursor_2 = controller.detect_wands() # find both cursors, which marks the timer itself
+    # otherwise the cursors from the last time they were looked for are used again
+    if model.tool != 'draw':
+        model.end_line() # another tool was picked, so the line is finished
+    if model.tool != 'erase':
+        model.end_erase()
 
     if model.tool == 'calibration color 1' or model.tool =='calibration color 2': # all this code only needs to run if the program is currently calibrating
-        model.elapsed_time = time.time() - model.calibration_start
+        model.elapsed_time = model.clock() - model.calibration_start
         if model.elapsed_time < model.calibration_time:
+            model.calibration.add(model.frame) # learn the wand's color from inside the circle, before anything is drawn over it
             cv2.putText(model.frame,'Place '+ model.tool + ' in center:' + str(int(model.calibration_time - model.elapsed_time)),(30,30),cv2.FONT_HERSHEY_DUPLEX,1,(255, 255, 255))
             cv2.circle(model.frame, (int(model.frame.shape[1]/2), int(model.frame.shape[0]/2)), 50,(255,255,255), thickness = 3)
             cv2.circle(model.frame, (int(model.frame.shape[1]/2), int(model.frame.shape[0]/2)), 55,(0,0,0), thickness = 3)
         elif model.elapsed_time > model.calibration_time:
-            kernel = np.ones((15, 15), 'uint8') # make a kernel for blurring
-            model.frame = cv2.dilate(model.frame, kernel) # blur the frame to average out the value in the circle
-            model.frame = cv2.GaussianBlur(model.frame, (17, 17), 0)
-            hsv_frame = cv2.cvtColor(model.frame, cv2.COLOR_BGR2HSV)
-            pixel = hsv_frame[int(model.frame.shape[0]/2), int(model.frame.shape[1]/2)] # grab the pixel from the center of the calibration circle
-            if model.tool == 'calibration color 1':
-                model.lower_color_1, model.upper_color_1 = (np.array([pixel[0]-10,50,50]), np.array([pixel[0]+10,250,250]))
+            bounds = model.calibration.bounds()
+            model.calibration.reset()
+            if bounds is None: # nothing colorful was held up, so try again
+                model.calibration_start = model.clock()
+            elif model.tool == 'calibration color 1':
+                model.lower_color_1, model.upper_color_1 = bounds
                 model.elapsed_time = 0
-                model.calibration_start = time.time()
+                model.calibration_start = model.clock()
                 model.tool = 'calibration color 2'
             elif model.tool =='calibration color 2':
-                model.lower_color_2, model.upper_color_2 = (np.array([pixel[0]-10,50,50]), np.array([pixel[0]+10,250,250]))
+                model.lower_color_2, model.upper_color_2 = bounds
                 model.tool = 'draw'
 
     elif model.tool == 'draw':
-        model.line_points.append(model.cursor_1) # if the program is drawing, it simply needs to add to the list of points to be drawn.
+        model.add_line_point(model.cursor_1) # if the program is drawing, it simply needs to add to the list of points to be drawn.
 
     elif model.tool == 'erase':
         view.remove_lines()
 
+    elif model.tool == 'save':
+        model.save_drawing()
+        model.tool = 'draw'
+
     elif model.tool == 'rectangle_1':
         if model.cursor_1:
-            model.rectangle_points.append(model.cursor_1)
+            model.add_rectangle_point(model.cursor_1)
             model.tool = 'rectangle_2'
 
     elif model.tool == 'rectangle_2':
         if model.cursor_1:
             cv2.rectangle(model.frame, model.rectangle_points[-1][0:2], model.cursor_1[0:2],model.rectangle_points[-1][2], model.rectangle_points[-1][-1])
         else:
-            model.rectangle_points.append(model.cursor_2)
-            model.rectangle_points.append(False)
+            model.add_rectangle_point(model.cursor_2)
+            model.add_rectangle_point(False)
+            model.record('rectangle', model.rectangle_points[-3:])
             model.tool = 'rectangle_1'
 
     elif model.tool == 'circle_1':
@@ -279,18 +617,25 @@ def process_frame(model, controller, view):
             cv2.circle(model.frame, model.ellipse_points[-1][0:2], radius, model.ellipse_points[-1][2], model.ellipse_points[-1][-1])
         elif model.cursor_2:
             radius = int(((model.ellipse_points[-1][0]-model.cursor_2[0])**2 + (model.ellipse_points[-1][1]-model.cursor_2[1])**2)**(1/2))
-            model.ellipse_points.append(radius)
+            model.add_ellipse_radius(radius)
             model.ellipse_points.append(False)
+            model.record('ellipse', model.ellipse_points[-3:])
             model.tool = 'circle_1'
 
     model.check_buttons(model.cursor_2)
+    model.timer.mark('tools')
 
-    view.show_lines()
-    view.show_rectangles()
-    view.show_circles()
+    view.show_drawing()
+    model.timer.mark('strokes')
 
     view.show_interface()
     view.show_cursor()
+    model.output = model.frame
+    model.output_tool = model.tool
+    model.output_pressed = bool(model.pressed_buttons)
+    model.timer.mark('interface')
+    if model.recorder is not None:
+        model.recorder.add(model, detected = detected)
 
 def main_loop():
     """
@@ -302,7 +647,7 @@ def main_loop():
     view = View(model)
     controller = Controller(model)
     cap = cv2.VideoCapture(0)
-    model.calibration_start = time.time()
+    model.calibration_start = model.clock()
     while True:
         _, model.frame = cap.read() # get a frame from the camera
         process_frame(model,controller,view) # this is where all the work is done.
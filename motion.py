@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+
+class MotionGate:
+    """
+    Notices when nothing in front of the camera has moved, so a frame can be skipped
+    instead of looking for the wands in it again. Each frame is shrunk to a tiny gray
+    image (size), which also smooths away most of the camera's noise, and compared to
+    the tiny image of the last frame that wasn't skipped. If fewer than min_pixels of
+    its pixels changed by more than threshold, the frame counts as still.
+
+    Even if nothing moves, a frame isn't counted as still once refresh frames in a row
+    have been, so slow changes (like the light) still get through now and then. A
+    threshold of 0 turns the gate off.
+    """
+    def __init__(self, threshold = 12, min_pixels = 6, refresh = 30, size = (80, 60)):
+        self.threshold = threshold
+        self.min_pixels = min_pixels
+        self.refresh = refresh
+        self.size = size
+        self.reference = None # the tiny image of the last frame that wasn't still
+        self.skipped = 0 # how many frames in a row have been still
+
+    def shrink(self, frame):
+        """
+        Shrinks a frame to a gray image of size. It is first shrunk to twice the size with
+        a quick resize that only averages a few of the pixels, and then averaged down the
+        rest of the way, which is much quicker than averaging every pixel of the frame.
+        """
+        half = cv2.resize(frame, (2 * self.size[0], 2 * self.size[1]), interpolation = cv2.INTER_LINEAR)
+        return cv2.resize(cv2.cvtColor(half, cv2.COLOR_BGR2GRAY), self.size, interpolation = cv2.INTER_AREA)
+
+    def still(self, frame):
+        """
+        Returns True if the frame looks the same as the last one that wasn't still.
+        Otherwise it becomes the one the next frames are compared to.
+        """
+        if not self.threshold:
+            return False
+        small = self.shrink(frame)
+        if self.reference is not None and self.skipped < self.refresh:
+            changed = np.count_nonzero(cv2.absdiff(small, self.reference) > self.threshold)
+            if changed < self.min_pixels:
+                self.skipped += 1
+                return True
+        self.reference = small
+        self.skipped = 0
+        return False
@@ -1,124 +1,120 @@
 import time
 import threading
 import os
-import cv2
-try:
-    from greenlet import getcurrent as get_ident
-except ImportError:
-    try:
-        from thread import get_ident
-    except ImportError:
-        from _thread import get_ident
-
-
-class CameraEvent(object):
-    """An Event-like class that signals all active clients when a new frame is
-    available.
-    """
-    def __init__(self):
-        self.events = {}
-
-    def wait(self):
-        """Invoked from each client's thread to wait for the next frame."""
-        ident = get_ident()
-        if ident not in self.events:
-            # this is a new client
-            # add an entry for it in the self.events dict
-            # each entry has two elements, a threading.Event() and a timestamp
-            self.events[ident] = [threading.Event(), time.time()]
-        return self.events[ident][0].wait()
-
-    def set(self):
-        """Invoked by the camera thread when a new frame is available."""
-        now = time.time()
-        remove = None
-        for ident, event in self.events.items():
-            if not event[0].isSet():
-                # if this client's event is not set, then set it
-                # also update the last set timestamp to now
-                event[0].set()
-                event[1] = now
-            else:
-                # if the client's event is already set, it means the client
-                # did not process a previous frame
-                # if the event stays set for more than 5 seconds, then assume
-                # the client is gone and remove it
-                if now - event[1] > 5:
-                    remove = ident
-        if remove:
-            del self.events[remove]
-
-    def clear(self):
-        """Invoked from each client's thread after a frame was processed."""
-        self.events[get_ident()][0].clear()
+from metrics import camera_thread_starts
+from pipeline import LatestSlot
+from sources import DeviceSource, parse_sources
 
 
 class Camera(object):
-    thread = None  # background thread that reads frames from camera
-    frame = None  # current frame is stored here by background thread
-    last_access = 0  # time of last client access to the camera
-    event = CameraEvent()
-    video_source = 0
-
-    def __init__(self):
-        """Start the background camera thread if it isn't running yet."""
-        if os.environ.get('OPENCV_CAMERA_SOURCE'):
-            Camera.set_video_source(int(os.environ['OPENCV_CAMERA_SOURCE']))
-        if Camera.thread is None:
-            Camera.last_access = time.time()
+    """Reads frames from one source on a background thread, and puts each new
+    frame in broadcast, for the pipelines subscribed to it. The thread is started
+    by start(), and stops once no pipeline has asked for a frame for idle_timeout
+    seconds (or never, if idle_timeout is None). ready is set once the first frame
+    has arrived.
+    """
+    def __init__(self, source, name='default', idle_timeout=10):
+        self.source = source
+        self.name = name
+        self.idle_timeout = idle_timeout
+        self.thread = None  # background thread that reads frames from the source
+        self.frame = None  # current frame is stored here by background thread
+        self.last_access = 0  # time of last client access to the camera
+        self.broadcast = LatestSlot()
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        self.interval = None  # smoothed seconds between frames from the source
+
+    def start(self):
+        """Start the background camera thread if it isn't running yet. This
+        doesn't wait for the source to open, see wait_ready for that.
+        """
+        with self.lock:
+            self.last_access = time.time()
+            if self.thread is not None:
+                return
 
             # start background frame thread
-            Camera.thread = threading.Thread(target=self._thread)
-            Camera.thread.start()
-
-            # wait until frames are available
-            while self.get_frame() is None:
-                time.sleep(0)
-
-    def get_frame(self):
-        """Return the current camera frame."""
-        Camera.last_access = time.time()
-
-        # wait for a signal from the camera thread
-        Camera.event.wait()
-        Camera.event.clear()
-
-        return Camera.frame
-
-    @staticmethod
-    def frames():
-        """"Generator that returns frames from the camera."""
-        raise RuntimeError('Must be implemented by subclasses.')
-
-    @classmethod
-    def _thread(cls):
+            self.thread = threading.Thread(target=self._thread, name='camera-' + self.name, daemon=True)
+            self.thread.start()
+            camera_thread_starts.inc()
+
+    def wait_ready(self, timeout=None):
+        """Wait until the camera has a frame, and return whether it does."""
+        return self.ready.wait(timeout)
+
+    def latest(self, after=0):
+        """Return (sequence, frame) for the newest frame, as a BGR array, if it is
+        newer than the sequence number after, or (after, None) straight away if it
+        isn't.
+
+        The array may be one of the source's reusable buffers and be written
+        over again a few frames later, so callers must not modify it and should
+        copy anything they want to keep around.
+        """
+        self.last_access = time.time()
+        return self.broadcast.take(after)
+
+    def _thread(self):
         """Camera background thread."""
-        print('Starting camera thread.')
-        frames_iterator = cls.frames()
-        for frame in frames_iterator:
-            Camera.frame = frame
-            Camera.event.set()  # send signal to clients
-            time.sleep(0)
-
-            # if there hasn't been any clients asking for frames in
-            # the last 10 seconds then stop the thread
-            if time.time() - Camera.last_access > 10:
-                frames_iterator.close()
-                print('Stopping camera thread due to inactivity.')
-                break
-        Camera.thread = None
-
-    @staticmethod
-    def set_video_source(source):
-        Camera.video_source = source
-
-    @staticmethod
-    def frames():
-        camera = cv2.VideoCapture(Camera.video_source)
-        if not camera.isOpened():
-            raise RuntimeError('Could not start camera.')
+        print('Starting camera thread for %s.' % self.name)
+        frames_iterator = self.source.frames()
+        last = None
+        try:
+            for frame in frames_iterator:
+                if frame is not None:  # sources give None while they are reconnecting
+                    now = time.perf_counter()
+                    if last is not None:
+                        self.interval = now - last if self.interval is None else 0.9 * self.interval + 0.1 * (now - last)
+                    last = now
+                    self.frame = frame
+                    self.broadcast.put(frame)  # send it to clients
+                    self.ready.set()
+
+                # if there hasn't been any clients asking for frames in
+                # the last idle_timeout seconds then stop the thread
+                if self.idle_timeout is not None and time.time() - self.last_access > self.idle_timeout:
+                    frames_iterator.close()
+                    print('Stopping camera thread for %s due to inactivity.' % self.name)
+                    break
+        finally:
+            self.ready.clear()
+            self.thread = None
+
+
+class CameraRegistry(object):
+    """All of the video sources the app can stream from, by name, with one
+    Camera (and so one capture thread) for each source that is being watched.
+    """
+    def __init__(self, sources, keep_warm=()):
+        self.sources = sources
+        self.cameras = {}
+        self.lock = threading.Lock()
+        for name in keep_warm:  # opened now, and kept open even with nobody watching
+            self.get(name, idle_timeout=None)
 
-        while True:
-            # read current frame
-            _, img = camera.read()
-            yield cv2.imencode('.jpg', img)[1].tobytes()
+    @classmethod
+    def from_environment(cls):
+        """Sources come from CVPAINT_SOURCES (see sources.parse_sources), or are
+        just camera OPENCV_CAMERA_SOURCE (0 if it isn't set either). The sources
+        named in CVPAINT_KEEP_WARM are opened straight away and never closed.
+        """
+        if os.environ.get('CVPAINT_SOURCES'):
+            sources = parse_sources(os.environ['CVPAINT_SOURCES'])
+        else:
+            sources = {'default': DeviceSource(int(os.environ.get('OPENCV_CAMERA_SOURCE', 0)))}
+        keep_warm = [name for name in os.environ.get('CVPAINT_KEEP_WARM', '').split(',') if name]
+        return cls(sources, keep_warm)
+
+    def get(self, name='default', idle_timeout=10):
+        """Return the camera for a source, starting its thread (again, if it had
+        stopped) without waiting for it. Raises KeyError for a source that
+        doesn't exist.
+        """
+        source = self.sources[name]
+        with self.lock:
+            camera = self.cameras.get(name)
+            if camera is None:
+                camera = self.cameras[name] = Camera(source, name, idle_timeout)
+        camera.start()
+        return camera
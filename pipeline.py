@@ -0,0 +1,267 @@
+import threading
+import time
+import traceback
+import cv2
+from metrics import MetricsTimer, stage_seconds, dropped_frames, still_frames
+from qos import QualityController
+
+class LatestSlot:
+    """
+    Passes items from one stage of the pipeline to the next, but only ever holds the
+    newest one. Every item put in gets the next sequence number, and a stage waiting for
+    something newer than the last item it saw gets whatever is newest, skipping the ones
+    it was too slow for instead of falling further and further behind. Any number of
+    stages or clients can wait on the same slot.
+
+    waiter, if it is set, lets clients that can't block on the condition (greenlets
+    sharing one thread, see serve.py) wait their own way: waiter.applies() says whether
+    the caller is one of them, waiter.wait(slot, after, timeout) then does the waiting,
+    and waiter.notify(slot) is called whenever the slot changes.
+
+    Instead of waiting, a stage can subscribe a function to be called (on the thread
+    that put it) every time there is a new item, and then take it.
+    """
+    waiter = None
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.item = None
+        self.sequence = 0
+        self.closed = False
+        self.subscribers = () # replaced rather than changed, so put can go through it without the lock
+
+    def put(self, item):
+        with self.condition:
+            self.item = item
+            self.sequence += 1
+            self.condition.notify_all()
+        if self.waiter is not None:
+            self.waiter.notify(self)
+        for subscriber in self.subscribers:
+            subscriber()
+
+    def subscribe(self, function):
+        with self.condition:
+            self.subscribers = self.subscribers + (function,)
+
+    def unsubscribe(self, function):
+        with self.condition:
+            self.subscribers = tuple(subscriber for subscriber in self.subscribers if subscriber != function)
+
+    def get(self, after = 0, timeout = None):
+        """
+        Waits for an item newer than the sequence number after, and returns its
+        (sequence, item). If the wait times out or the slot is closed, returns
+        (after, None) instead. Skipped items are counted as dropped frames.
+        """
+        if self.waiter is not None and self.waiter.applies():
+            return self.waiter.wait(self, after, timeout)
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > after or self.closed, timeout)
+            return self.take(after)
+
+    def take(self, after):
+        """
+        Like get, but returns (after, None) straight away if there isn't anything newer.
+        """
+        with self.condition:
+            if self.sequence <= after:
+                return after, None
+            if after and self.sequence > after + 1:
+                dropped_frames.inc(self.sequence - after - 1)
+            return self.sequence, self.item
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.waiter is not None:
+            self.waiter.notify(self)
+
+def run_blocking(function, *args):
+    """
+    Calls function, which may have to wait for a lock held by a worker thread. If the
+    caller is a greenlet (see LatestSlot.waiter), it is run on another thread instead,
+    so the other greenlets don't have to wait too.
+    """
+    waiter = LatestSlot.waiter
+    if waiter is not None and waiter.applies():
+        return waiter.run(function, *args)
+    return function(*args)
+
+class PoolStage:
+    """
+    Runs one stage of a pipeline on a shared pool of worker threads, instead of on a
+    thread of its own. poke() says there is something new for it; step is then run on
+    the pool, never more than once at a time, and once more when it finishes if it was
+    poked again meanwhile, so it always gets to the newest input. If step raises, the
+    error is printed and failed is called.
+    """
+    def __init__(self, pool, step, failed):
+        self.pool = pool
+        self.step = step
+        self.failed = failed
+        self.lock = threading.Lock()
+        self.scheduled = False # whether it is on the pool, waiting or running
+        self.again = False # whether it was poked while it was
+
+    def poke(self):
+        with self.lock:
+            if self.scheduled:
+                self.again = True
+                return
+            self.scheduled = True
+        try:
+            self.pool.submit(self.run)
+        except RuntimeError: # the pool has been shut down, which only happens as the program exits
+            pass
+
+    def run(self):
+        while True:
+            try:
+                self.step()
+            except Exception:
+                traceback.print_exc()
+                self.failed()
+            with self.lock:
+                if not self.again:
+                    self.scheduled = False
+                    return
+                self.again = False
+
+class SessionPipeline:
+    """
+    Gets one session's frames from the camera to its viewers in stages: the camera
+    thread captures, the process stage runs MP4 on the newest frame, and the encode
+    stage turns the newest processed frame into a JPEG that every viewer of the session
+    shares. The process and encode stages run on the registry's worker pool (see
+    PoolStage) whenever there is a new frame for them, so a session doesn't need
+    threads of its own, however many there are. Stages hand frames to
+    each other through LatestSlots, so a slow stage or viewer drops old frames instead of
+    building up a queue, and processing the next frame happens while the last one is
+    being encoded. If nothing moved and the session gives back the same frame as last
+    time, it isn't passed on at all. Frames are only encoded while somebody is watching
+    the video; clients that draw the strokes themselves (see events.py) just follow
+    along with updates(). The pipeline stops itself once nobody has watched or listened
+    for idle_timeout seconds.
+
+    How long each stage takes, and how old frames are when they get to a viewer, go to
+    a qos.QualityController (made with the options in quality), which picks the JPEG
+    quality, the output scale and how often the wands are looked for.
+    """
+    def __init__(self, session, camera, pool, idle_timeout = 10, quality = {}):
+        self.session = session
+        self.camera = camera
+        self.pool = pool
+        self.idle_timeout = idle_timeout
+        self.quality = QualityController(**quality)
+        self.processed = LatestSlot()
+        self.encoded = LatestSlot()
+        self.lock = threading.Lock()
+        self.viewers = 0 # clients watching the video
+        self.listeners = 0 # clients following along with updates()
+        self.last_viewer = time.time()
+        self.running = True
+        self.camera_sequence = 0 # of the last camera frame processed
+        self.processed_sequence = 0 # of the last processed frame encoded
+        self.output = None # the last frame the session gave back
+        self.stills = 0 # camera frames left out so far because nothing moved
+        self.process_timer = MetricsTimer(stage_seconds)
+        self.encode_timer = MetricsTimer(stage_seconds)
+        self.process_stage = PoolStage(pool, self.process, self.stop)
+        self.encode_stage = PoolStage(pool, self.encode, self.stop)
+        self.camera.broadcast.subscribe(self.process_stage.poke)
+        self.process_stage.poke() # in case the camera already has a frame
+
+    def idle(self):
+        return self.viewers == 0 and self.listeners == 0 and time.time() - self.last_viewer > self.idle_timeout
+
+    def process(self):
+        if not self.running:
+            return
+        if self.idle():
+            self.stop()
+            return
+        self.camera_sequence, frame = self.camera.latest(self.camera_sequence)
+        if frame is None: # the camera is still starting, or reconnecting
+            return
+        self.process_timer.start()
+        arrived = time.perf_counter()
+        frame = frame.copy() # the source reads new frames into the same few buffers, and may soon write over this one
+        last_output, self.output = self.output, self.session.process(frame, self.quality.detect_every)
+        if self.output is last_output: # nothing moved, so there is nothing new to encode or send
+            still_frames.inc()
+            self.stills += 1
+        else:
+            self.processed.put((self.output, arrived, self.stills))
+            if self.viewers: # nobody is watching the video otherwise, so there is no need for JPEGs
+                self.encode_stage.poke()
+        self.quality.observe('process', time.perf_counter() - arrived)
+        self.process_timer.mark('process')
+
+    def encode(self):
+        self.processed_sequence, item = self.processed.take(self.processed_sequence)
+        if item is None or not self.running:
+            return
+        self.encode_timer.start()
+        frame, arrived, stills = item
+        started = time.perf_counter()
+        scale = self.quality.scale
+        if scale != 1:
+            frame = cv2.resize(frame, None, fx = scale, fy = scale, interpolation = cv2.INTER_AREA)
+        self.encoded.put((cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality.jpeg_quality])[1].tobytes(), arrived, stills))
+        self.quality.observe('encode', time.perf_counter() - started)
+        self.encode_timer.mark('encode')
+
+    def stop(self):
+        self.running = False
+        self.camera.broadcast.unsubscribe(self.process_stage.poke)
+        self.processed.close()
+        self.encoded.close()
+
+    def frames(self):
+        """
+        Generator for one viewer, which gives the newest JPEG every time there is a new
+        one, skipping any that came out while the viewer was busy.
+        """
+        with self.lock:
+            self.viewers += 1
+        try:
+            sequence = 0
+            last = None
+            last_stills = 0
+            while self.running:
+                sequence, item = self.encoded.get(sequence, timeout = 1)
+                if item is not None:
+                    frame, arrived, stills = item
+                    started = time.perf_counter()
+                    if last is not None: # frames that were still don't count towards the wait, see qos.py
+                        self.quality.observe_interval(started - last, getattr(self.camera, 'interval', None), stills - last_stills)
+                    last, last_stills = started, stills
+                    yield frame
+                    now = time.perf_counter() # the viewer is back for another, so this one has been sent
+                    self.quality.observe('send', now - started)
+                    self.quality.observe_latency(now - arrived)
+                else:
+                    last = None # nothing came for a while, which isn't the pipeline being slow
+        finally:
+            with self.lock:
+                self.viewers -= 1
+                self.last_viewer = time.time()
+
+    def updates(self):
+        """
+        Generator for one client that isn't watching the video, which gives True every
+        time a frame has been processed, or False if none has been for a second.
+        """
+        with self.lock:
+            self.listeners += 1
+        try:
+            sequence = 0
+            while self.running:
+                sequence, frame = self.processed.get(sequence, timeout = 1)
+                yield frame is not None
+        finally:
+            with self.lock:
+                self.listeners -= 1
+                self.last_viewer = time.time()
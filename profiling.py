@@ -0,0 +1,45 @@
+import time
+import numpy as np
+
+class StageTimer:
+    """
+    Times how long each stage of processing a frame takes. start() is called at the
+    beginning of a frame, and mark(stage) at the end of each stage, which adds the time
+    since the last call to that stage.
+    """
+    def __init__(self):
+        self.samples = {} # stage -> list of how long it took each time, in seconds
+        self.last = time.perf_counter()
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.samples.setdefault(stage, []).append(now - self.last)
+        self.last = now
+
+    def summary(self):
+        """
+        Returns the mean, median, 95th percentile and worst time of every stage, in
+        milliseconds, along with how many times it ran.
+        """
+        summary = {}
+        for stage, samples in self.samples.items():
+            samples = np.array(samples) * 1000
+            summary[stage] = {'count': len(samples),
+                'mean_ms': round(float(samples.mean()), 4),
+                'p50_ms': round(float(np.percentile(samples, 50)), 4),
+                'p95_ms': round(float(np.percentile(samples, 95)), 4),
+                'max_ms': round(float(samples.max()), 4)}
+        return summary
+
+class NullTimer:
+    """
+    A timer that doesn't time anything, used when nobody is measuring.
+    """
+    def start(self):
+        pass
+
+    def mark(self, stage):
+        pass
@@ -0,0 +1,152 @@
+"""
+Keeps a session's video flowing at target_fps on a host that may be too busy for it.
+Each stage of the pipeline reports how long it took for every frame, and viewers report
+how long sending took, how old the frame was by then (its latency) and how long it has
+been since the last one. When the slowest stage can't keep up, frames get too old, or
+viewers get frames further apart than the camera gives them (so some stage is starved
+of CPU by everything else going on), one setting is turned down, picked by what is
+slow. Frames left out because nothing moved (see motion.py) don't count as starving:
+
+    process   detect the wands on only every detect_every frames
+    encode    lower the JPEG quality, then shrink the output
+    send      shrink the output, then lower the JPEG quality
+
+Once everything has been comfortably fast for a while, the settings are turned back up,
+the last one turned down first. The gap between "too slow" and "comfortably fast", and
+waiting between changes, stop the settings from flipping back and forth.
+"""
+import threading
+import time
+
+JPEG_QUALITIES = (90, 75, 60, 45)
+SCALES = (1, 0.75, 0.5)
+DETECT_EVERY = (1, 2, 3)
+
+# which settings help when each stage is too slow, best first
+REMEDIES = {'process': ('detect_every', 'jpeg_quality', 'scale'),
+    'encode': ('jpeg_quality', 'scale', 'detect_every'),
+    'send': ('scale', 'jpeg_quality', 'detect_every')}
+
+class QualityController:
+    """
+    Picks the JPEG quality, output scale and detection cadence of one pipeline. A stage
+    is too slow once its smoothed time per frame goes over slow times the frame budget
+    (1 / target_fps), and everything is comfortably fast once every stage is under fast
+    times the budget and latency is under half of max_latency. At most one change is
+    made every cooldown seconds, and settings are only turned back up after hold
+    seconds of being comfortably fast.
+    """
+    ladders = {'jpeg_quality': JPEG_QUALITIES, 'scale': SCALES, 'detect_every': DETECT_EVERY}
+
+    def __init__(self, target_fps = 20, max_latency = 0.25, slow = 1.1, fast = 0.6, cooldown = 2, hold = 5, smoothing = 0.2):
+        self.target_fps = target_fps
+        self.budget = 1 / target_fps
+        self.max_latency = max_latency
+        self.slow = slow
+        self.fast = fast
+        self.cooldown = cooldown
+        self.hold = hold
+        self.smoothing = smoothing
+        self.costs = {} # stage -> smoothed seconds per frame
+        self.latency = None
+        self.interval = None # smoothed seconds between frames getting to viewers
+        self.expected_interval = None # and how far apart they should be, smoothed the same way
+        self.levels = {setting: 0 for setting in self.ladders} # how far down its ladder each setting is
+        self.lowered = [] # settings in the order they were turned down
+        self.changed = time.monotonic()
+        self.fast_since = None # when everything became comfortably fast
+        self.lock = threading.Lock()
+
+    @property
+    def jpeg_quality(self):
+        return JPEG_QUALITIES[self.levels['jpeg_quality']]
+
+    @property
+    def scale(self):
+        return SCALES[self.levels['scale']]
+
+    @property
+    def detect_every(self):
+        return DETECT_EVERY[self.levels['detect_every']]
+
+    def smooth(self, old, new):
+        return new if old is None else old + self.smoothing * (new - old)
+
+    def observe(self, stage, seconds):
+        """
+        Adds how long a stage ('process', 'encode' or 'send') took for one frame.
+        """
+        with self.lock:
+            self.costs[stage] = self.smooth(self.costs.get(stage), seconds)
+            self.adjust()
+
+    def observe_latency(self, seconds):
+        """
+        Adds how long it was from a frame arriving from the camera to it being sent.
+        """
+        with self.lock:
+            self.latency = self.smooth(self.latency, seconds)
+            self.adjust()
+
+    def observe_interval(self, seconds, camera_interval = None, skipped = 0):
+        """
+        Adds how long a viewer waited since its last frame, how far apart the camera is
+        giving frames, and how many camera frames in between were skipped on purpose
+        since nothing moved. Each of those adds another camera interval to the wait
+        expected.
+        """
+        with self.lock:
+            self.interval = self.smooth(self.interval, seconds)
+            self.expected_interval = self.smooth(self.expected_interval, max(self.budget, (camera_interval or 0) * (1 + skipped)))
+            self.adjust()
+
+    def adjust(self):
+        """
+        Turns a setting down or up if it is time to. Must be called with the lock held.
+        """
+        if not self.costs:
+            return
+        now = time.monotonic()
+        stage = max(self.costs, key = self.costs.get)
+        cost = self.costs[stage]
+        latency = self.latency or 0
+        expected = self.expected_interval or self.budget
+        starved = (self.interval or 0) > self.slow * expected
+        if cost > self.slow * self.budget or latency > self.max_latency or starved:
+            self.fast_since = None
+            if now - self.changed > self.cooldown:
+                remedies = REMEDIES[stage] if cost > self.slow * self.budget or starved else REMEDIES['encode'] # just late, so make frames quicker to get out
+                for setting in remedies:
+                    if self.levels[setting] < len(self.ladders[setting]) - 1:
+                        self.levels[setting] += 1
+                        self.lowered.append(setting)
+                        self.changed = now
+                        break
+        elif all(cost < self.fast * self.budget for cost in self.costs.values()) and latency < self.max_latency / 2 \
+                and (self.interval or 0) < expected / self.fast ** 0.5:
+            if self.fast_since is None:
+                self.fast_since = now
+            if self.lowered and now - self.fast_since > self.hold and now - self.changed > self.cooldown:
+                self.levels[self.lowered.pop()] -= 1
+                self.changed = now
+                self.fast_since = now # and wait a while again before the next one
+        else:
+            self.fast_since = None
+
+    def degraded(self):
+        return bool(self.lowered)
+
+    def settings(self):
+        """
+        The settings being used right now, along with the measurements they were picked
+        from (in milliseconds), for a page to show.
+        """
+        with self.lock:
+            return {'jpeg_quality': self.jpeg_quality,
+                'scale': self.scale,
+                'detect_every': self.detect_every,
+                'target_fps': self.target_fps,
+                'max_latency_ms': round(self.max_latency * 1000, 1),
+                'stage_ms': {stage: round(cost * 1000, 2) for stage, cost in self.costs.items()},
+                'latency_ms': None if self.latency is None else round(self.latency * 1000, 2),
+                'fps': None if not self.interval else round(1 / self.interval, 1)}
@@ -0,0 +1,224 @@
+"""
+Recording what happens in a session, and playing it back. A Recorder (see
+Model.recorder) writes down, for every frame process_frame handles, the cursors it
+found, whether it skipped the frame because nothing moved, the tool it ended up with
+and the buttons that got pressed. The video isn't kept, so a recording takes around 20
+bytes a frame, a couple of megabytes for an hour at 30 frames per second.
+
+Playing a recording back (replay) puts the same cursors through process_frame on blank
+frames, with the clock giving the times from the recording. It goes through the tools
+exactly the same way every time, without a camera or looking for the wands, so bugs
+seen live can be reproduced, and the drawing part of process_frame can be timed on its
+own:
+
+    python recording.py session.cvr --repeat 10 --save last.png
+
+A recording starts with MAGIC, followed by one record for each frame:
+
+    time          float64     model.clock() during the frame
+    flags         uint8       which of the parts below are there (the *_FLAG bits)
+    detect_every  uint8
+    size          2 uint16    width and height, when the frame changed size
+    cursors       2 of uint8 kind (NOT_FOUND, TOO_SMALL or FOUND), int16 x, int16 y,
+                  when the wands were looked for
+    tool          uint8 length and the name in UTF-8, when the tool changed
+    presses       uint8 count and the number of each button in BUTTONS, when any were
+                  pressed
+"""
+import argparse
+import math
+import struct
+import sys
+import time
+from collections import namedtuple
+import numpy as np
+import cv2
+from mini_project_4 import Model, ReplayController, View, process_frame
+from profiling import StageTimer
+
+MAGIC = b'CVPR\x01'
+STILL_FLAG, SIZE_FLAG, CURSORS_FLAG, TOOL_FLAG, PRESSES_FLAG = 1, 2, 4, 8, 16
+NOT_FOUND, TOO_SMALL, FOUND = 0, 1, 2
+
+# the Model attributes of the buttons that can be pressed, numbered by where they are here
+BUTTONS = ('clear', 'pen', 'erase', 'thicknessess', 'color', 'rectangle', 'ellipse', 'undo_button', 'redo_button', 'save', 'calibrate',
+    'draw_thin', 'draw_medium', 'draw_thick', 'color_choice')
+
+HEADER = struct.Struct('<dBB')
+SIZE = struct.Struct('<HH')
+CURSOR = struct.Struct('<Bhh')
+
+Frame = namedtuple('Frame', ['time', 'still', 'detect_every', 'size', 'blobs', 'tool', 'presses'])
+
+class Recorder:
+    """
+    Writes down what happens in each frame of a model, to file (opened in binary).
+    """
+    def __init__(self, file):
+        self.file = file
+        self.file.write(MAGIC)
+        self.size = None
+        self.tool = None
+        self.numbers = None # button -> its number in BUTTONS
+
+    @classmethod
+    def open(cls, path):
+        return cls(open(path, 'wb'))
+
+    def add(self, model, still = False, detected = False):
+        """
+        Writes down the frame process_frame just finished. still is whether it was
+        skipped since nothing moved, and detected whether the wands were looked for.
+        """
+        flags = STILL_FLAG if still else 0
+        parts = []
+        size = (model.frame.shape[1], model.frame.shape[0])
+        if size != self.size:
+            flags |= SIZE_FLAG
+            parts.append(SIZE.pack(*size))
+            self.size = size
+        if detected:
+            flags |= CURSORS_FLAG
+            for cursor in (model.cursor_1, model.cursor_2):
+                if cursor:
+                    parts.append(CURSOR.pack(FOUND, int(cursor[0]), int(cursor[1])))
+                else:
+                    parts.append(CURSOR.pack(NOT_FOUND if cursor is None else TOO_SMALL, 0, 0))
+        if model.tool != self.tool:
+            flags |= TOOL_FLAG
+            name = model.tool.encode()
+            parts.append(bytes([len(name)]) + name)
+            self.tool = model.tool
+        if model.pressed_buttons:
+            if self.numbers is None:
+                self.numbers = {getattr(model, name): number for number, name in enumerate(BUTTONS)}
+            flags |= PRESSES_FLAG
+            parts.append(bytes([len(model.pressed_buttons)] + [self.numbers[button] for button in model.pressed_buttons]))
+        self.file.write(HEADER.pack(model.clock(), flags, model.detect_every) + b''.join(parts))
+
+    def close(self):
+        self.file.close()
+
+def read(file):
+    """
+    Yields a Frame for each record in a recording. Every Frame has the size and tool as
+    of that frame, whether or not they changed. blobs are the wands as a detector would
+    have found them (see ReplayController), or None if they weren't looked for, and
+    presses are the names in BUTTONS of the buttons pressed.
+    """
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a recording')
+    size = tool = None
+    while True:
+        header = file.read(HEADER.size)
+        if len(header) < HEADER.size: # the end, or a record cut off by the program stopping
+            return
+        clock, flags, detect_every = HEADER.unpack(header)
+        blobs = None
+        presses = ()
+        if flags & SIZE_FLAG:
+            size = SIZE.unpack(file.read(SIZE.size))
+        if flags & CURSORS_FLAG:
+            blobs = []
+            for i in range(2):
+                kind, x, y = CURSOR.unpack(file.read(CURSOR.size))
+                blobs.append(None if kind == NOT_FOUND else ((x, y), 0 if kind == TOO_SMALL else math.inf))
+        if flags & TOOL_FLAG:
+            length = file.read(1)[0]
+            tool = file.read(length).decode()
+        if flags & PRESSES_FLAG:
+            count = file.read(1)[0]
+            presses = tuple(BUTTONS[number] for number in file.read(count))
+        yield Frame(clock, bool(flags & STILL_FLAG), detect_every, size, blobs, tool, presses)
+
+def load(path):
+    with open(path, 'rb') as file:
+        return list(read(file))
+
+class RecordedClock:
+    """
+    A clock for the model that gives the time of the frame being played back.
+    """
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+class RecordedMotion:
+    """
+    Stands in for the model's MotionGate, and says a frame is still if it was skipped in
+    the recording.
+    """
+    def __init__(self):
+        self.next = False
+
+    def still(self, frame):
+        return self.next
+
+class NullExporter:
+    """
+    Stands in for export.exporter, since there is no picture worth saving in a replay.
+    """
+    def submit(self, model, directory, number):
+        return None
+
+def replay(frames, model = None, timer = None):
+    """
+    Plays recorded frames back through process_frame on a new model (or the one given).
+    The colors of the wands can't be learned again without the video, so the tool is
+    set to what it was in the recording after each frame, which is what ends
+    calibrating. Returns the model and how many frames went differently than in the
+    recording otherwise (other buttons were pressed, or the tool came out different),
+    which should be none.
+    """
+    if model is None:
+        model = Model()
+    view = View(model)
+    controller = ReplayController(model, blobs = True)
+    model.clock = RecordedClock()
+    model.motion = RecordedMotion()
+    model.exporter = NullExporter()
+    if timer is not None:
+        model.timer = timer
+    blank = None
+    differences = 0
+    for frame in frames:
+        if blank is None or blank.shape[0:2] != (frame.size[1], frame.size[0]):
+            blank = np.zeros((frame.size[1], frame.size[0], 3), np.uint8)
+        model.clock.time = frame.time
+        model.motion.next = frame.still
+        model.detect_every = frame.detect_every
+        if frame.blobs is not None:
+            controller.add(frame.blobs)
+        model.frame = blank
+        calibrating = model.tool in ('calibration color 1', 'calibration color 2')
+        process_frame(model, controller, view)
+        presses = tuple(name for button in model.pressed_buttons for name in BUTTONS if getattr(model, name) is button)
+        if presses != frame.presses or (model.tool != frame.tool and not calibrating):
+            differences += 1
+        model.tool = frame.tool
+    return model, differences
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Play back a recording of a session without a camera.')
+    parser.add_argument('recording', help = 'the recording, written by a recording.Recorder')
+    parser.add_argument('--repeat', type = int, default = 1, help = 'play it back this many times, to time it')
+    parser.add_argument('--save', help = 'write the last frame to this image file')
+    args = parser.parse_args()
+
+    frames = load(args.recording)
+    timer = StageTimer()
+    started = time.perf_counter()
+    for i in range(args.repeat):
+        model, differences = replay(frames, timer = timer)
+    elapsed = time.perf_counter() - started
+    print('%d frames, %d different from the recording' % (len(frames), differences), file = sys.stderr)
+    print('%.1f frames per second' % (len(frames) * args.repeat / elapsed), file = sys.stderr)
+    for stage, stats in timer.summary().items():
+        print('%-20s %8.3f ms mean %8.3f ms p95' % (stage, stats['mean_ms'], stats['p95_ms']), file = sys.stderr)
+    if args.save and model.frame is not None:
+        cv2.imwrite(args.save, model.frame)
+
+if __name__ == '__main__':
+    main()
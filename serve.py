@@ -0,0 +1,85 @@
+"""
+Runs CVPaint for real, instead of with Flask's development server. Requests are
+handled by gevent greenlets, so a browser watching the video (or a slow one, or one
+that went quiet) only costs a greenlet instead of a whole thread, and hundreds of them
+can be connected at once. The actual work on frames still happens on ordinary threads:
+the camera threads, and the pool of workers that process and encode the frames of every
+session (CVPAINT_WORKERS of them).
+
+    python serve.py
+
+PORT and HOST say where to listen, CVPAINT_MAX_CONNECTIONS how many connections to
+handle at once (more wait until one closes), and CVPAINT_BLOCKING_THREADS how many
+threads greenlets can hand work that waits on a lock to.
+"""
+from gevent import monkey
+monkey.patch_all(thread = False, queue = False) # sockets and sleeps become cooperative, but threads (and the queues between them) stay real
+
+import os
+import threading
+import time
+from collections import deque
+import gevent
+from gevent.event import Event
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+from gevent.threadpool import ThreadPool
+from pipeline import LatestSlot
+
+class GreenletWaiter:
+    """
+    Lets greenlets wait on LatestSlots. All of the greenlets share one thread, so one of
+    them blocking on a slot's condition would stop every other one. Instead, a greenlet
+    waits on a gevent Event for the slot. Slots are changed by other threads, which
+    can't touch gevent objects, so they put the slot in a queue and poke the hub through
+    an async watcher (the one thing that is safe to do from another thread), and the
+    hub then sets the Events of the slots in the queue.
+    """
+    def __init__(self, blocking_threads = 10):
+        self.hub = gevent.get_hub()
+        self.thread = threading.get_ident()
+        self.events = {} # slot -> Event its waiting greenlets wait on, only used in the hub's thread
+        self.changed = deque() # slots that changed, from any thread
+        self.watcher = self.hub.loop.async_()
+        self.watcher.start(self.wake)
+        self.pool = ThreadPool(blocking_threads)
+
+    def applies(self):
+        return threading.get_ident() == self.thread and gevent.getcurrent() is not self.hub
+
+    def notify(self, slot):
+        self.changed.append(slot)
+        self.watcher.send()
+
+    def wake(self):
+        while self.changed:
+            event = self.events.pop(self.changed.popleft(), None)
+            if event is not None:
+                event.set()
+
+    def wait(self, slot, after, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            event = self.events.setdefault(slot, Event()) # before looking at the slot, so a change right after can't be missed
+            sequence, item = slot.take(after)
+            if sequence > after or slot.closed:
+                return sequence, item
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return after, None
+            event.wait(remaining)
+
+    def run(self, function, *args):
+        return self.pool.apply(function, args)
+
+def main():
+    LatestSlot.waiter = GreenletWaiter(int(os.environ.get('CVPAINT_BLOCKING_THREADS', 10)))
+    from CVpaint import app # after the waiter is set up, since making the app can start cameras
+    host = os.environ.get('HOST', '0.0.0.0')
+    port = int(os.environ.get('PORT', 5000))
+    pool = Pool(int(os.environ.get('CVPAINT_MAX_CONNECTIONS', 1000)))
+    print('Serving on http://%s:%d' % (host, port))
+    WSGIServer((host, port), app, spawn = pool).serve_forever()
+
+if __name__ == '__main__':
+    main()
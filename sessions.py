@@ -0,0 +1,148 @@
+import os
+import re
+import threading
+import time
+import uuid
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+from mini_project_4 import Model, Controller, View, process_frame
+from metrics import MetricsTimer, stage_seconds
+from pipeline import SessionPipeline
+from motion import MotionGate
+from recording import Recorder
+
+def file_name(session_id):
+    """
+    A session id made safe to put in a file name, with anything but letters, digits, -
+    and _ replaced. The registry only hands out uuid hex ids, which come through as
+    they are.
+    """
+    return re.sub(r'[^A-Za-z0-9_-]', '_', session_id)
+
+class Session:
+    """
+    Everything one person drawing in their browser needs: their own model, view and
+    controller. This way people drawing in different browsers each get their own
+    canvas instead of drawing over each other. detection holds the options for how
+    the wands are found, which are passed on to the Controller, and motion the options
+    for the model's motion.MotionGate. If record_directory is given, everything that
+    happens in the session is recorded to a file there (see recording.py).
+    """
+    def __init__(self, session_id, detection = {}, motion = {}, record_directory = None):
+        self.id = session_id
+        self.model = Model()
+        self.model.timer = MetricsTimer(stage_seconds)
+        self.model.motion = MotionGate(**motion)
+        self.model.export_directory = os.path.join(self.model.export_directory, file_name(session_id)) # so people only download their own drawings
+        if record_directory:
+            path = os.path.join(record_directory, '%s-%s.cvr' % (file_name(session_id), time.strftime('%Y%m%d-%H%M%S')))
+            try:
+                os.makedirs(record_directory, exist_ok = True)
+                self.model.recorder = Recorder.open(path)
+            except OSError as error: # the session works just as well without a recording
+                print('Could not record session to %s: %r' % (path, error))
+        self.view = View(self.model)
+        self.controller = Controller(self.model, **detection)
+        self.lock = threading.Lock() # only one frame at a time gets processed for a session
+        self.last_access = time.time()
+        self.pipeline = None
+
+    def process(self, frame, detect_every = 1):
+        """
+        Runs MP4 on a camera frame and returns the finished frame. The wands are only
+        looked for on every detect_every frames. Every tab the session is open in watches
+        the same pipeline, so each camera frame only comes here once.
+        """
+        with self.lock:
+            self.last_access = time.time()
+            self.model.detect_every = detect_every
+            self.model.frame = frame
+            process_frame(self.model, self.controller, self.view)
+            return self.model.frame
+
+    def close(self):
+        with self.lock:
+            if self.model.recorder is not None:
+                self.model.recorder.close()
+                self.model.recorder = None
+
+class CameraSession:
+    """
+    Stands in for a session to stream the camera on its own, just mirrored like the
+    drawing view is, for clients that draw everything else themselves. There is one of
+    these for everybody, so the camera image is only mirrored and encoded once however
+    many clients are watching it.
+    """
+    def __init__(self, source = 'default'):
+        self.id = 'camera-' + source
+        self.pipeline = None
+
+    def process(self, frame, detect_every = 1):
+        return cv2.flip(frame, 1)
+
+class SessionRegistry:
+    """
+    Keeps track of all of the sessions by the id stored in each browser's cookie. The
+    frames of every session are processed on one pool of worker threads, so the
+    number of frames being worked on at once stays bounded no matter how many people
+    are connected. Sessions that haven't been used in a while are thrown away.
+    """
+    def __init__(self, max_workers = 4, idle_timeout = 300, detection = {}, motion = {}, quality = {}, record_directory = None):
+        self.sessions = {}
+        self.detection = detection
+        self.motion = motion
+        self.quality = quality # options for each pipeline's qos.QualityController
+        self.record_directory = record_directory # where to record sessions to, if anywhere
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'session')
+        self.idle_timeout = idle_timeout
+        self.cameras = {} # source name -> CameraSession
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+    def get(self, session_id = None):
+        """
+        Returns the session with this id. If there isn't one (the id is None, made up,
+        or of a session that has been thrown away), a new session is made with a new
+        id from new_id. Ids end up in file names, so only ones made here are used.
+        """
+        with self.lock:
+            self.evict_idle()
+            session = self.sessions.get(session_id)
+            if session is None:
+                session_id = self.new_id()
+                session = Session(session_id, self.detection, self.motion, self.record_directory)
+                self.sessions[session_id] = session
+            session.last_access = time.time()
+            return session
+
+    def evict_idle(self):
+        """
+        Removes every session that hasn't been used for longer than idle_timeout. Must be
+        called with the lock held.
+        """
+        now = time.time()
+        for session_id in [i for i, session in self.sessions.items() if now - session.last_access > self.idle_timeout]:
+            self.sessions.pop(session_id).close()
+
+    def pipeline(self, session, camera):
+        """
+        Returns the running pipeline that streams a session's frames, starting one if
+        it doesn't have one yet.
+        """
+        with self.lock:
+            if session.pipeline is not None and session.pipeline.camera is not camera: # it switched to a different source
+                session.pipeline.stop()
+            if session.pipeline is None or not session.pipeline.running:
+                session.pipeline = SessionPipeline(session, camera, self.pool, quality = self.quality)
+            session.pipeline.last_viewer = time.time() # so it doesn't stop before the new viewer starts watching
+            return session.pipeline
+
+    def camera_session(self, source):
+        """
+        Returns the CameraSession that everybody shares for the plain feed of a source.
+        """
+        with self.lock:
+            return self.cameras.setdefault(source, CameraSession(source))
@@ -0,0 +1,215 @@
+"""
+Where camera frames come from. A source is anything with a frames() generator that
+gives BGR images one at a time, at whatever pace the source runs at. Besides a real
+camera, frames can come from a video file, a folder of images or a synthetic scene,
+which makes it possible to run the whole app (or load test it) without a camera.
+
+Sources are usually described by a short string, see parse_source:
+
+    0                          camera number 0
+    file:recording.mp4         a video file, played back at its own frame rate
+    file:recording.mp4?fast    a video file, as fast as it can be read
+    images:frames/*.png        every image matching a pattern, in order
+    synthetic:640x480          the benchmark's scene of fake wands drawing
+"""
+import glob
+import time
+import cv2
+from metrics import stage_seconds, camera_reconnects
+
+class Source:
+    """
+    Something that frames can be read from. loop makes sources that run out of frames
+    (like files) start over from the beginning.
+    """
+    fps = 30
+
+    def frames(self):
+        raise NotImplementedError
+
+    def paced(self, frames, fps):
+        """
+        Gives the frames at fps frames a second, based on when they should have come
+        out rather than on how long the last one took, so the pace doesn't drift.
+        """
+        interval = 1 / fps
+        next_time = time.perf_counter()
+        for frame in frames:
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.perf_counter() # fell behind, so don't try to catch up in a burst
+            next_time += interval
+            yield frame
+
+class DeviceSource(Source):
+    """
+    A camera plugged into this computer, by its OpenCV device number. Frames are read
+    straight into a small ring of arrays that get reused, instead of making a new array
+    for every frame, so clients must copy anything they want to keep.
+
+    If the camera can't be opened or stops giving frames (it was unplugged, say), it is
+    opened again, waiting twice as long after each failure up to max_backoff seconds.
+    None is given instead of a frame while that happens, so whoever is reading can still
+    decide to stop.
+    """
+    def __init__(self, device = 0, buffer_count = 3, min_backoff = 0.25, max_backoff = 8):
+        self.device = device
+        self.buffer_count = buffer_count
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+    def open(self):
+        camera = cv2.VideoCapture(self.device)
+        if camera.isOpened():
+            return camera
+        camera.release()
+        return None
+
+    def frames(self):
+        camera = None
+        backoff = self.min_backoff
+        try:
+            while True:
+                if camera is None:
+                    camera = self.open()
+                    buffers = [None] * self.buffer_count
+                    index = 0
+                    if camera is None:
+                        print('Could not open camera %s, trying again in %g seconds.' % (self.device, backoff))
+                        yield None
+                        time.sleep(backoff)
+                        backoff = min(2 * backoff, self.max_backoff)
+                        continue
+                started = time.perf_counter()
+                ok, image = camera.read(buffers[index])
+                stage_seconds.labels('capture').observe(time.perf_counter() - started)
+                if not ok:
+                    print('Lost camera %s, reconnecting.' % self.device)
+                    camera_reconnects.inc()
+                    camera.release()
+                    camera = None
+                    yield None
+                    time.sleep(backoff)
+                    backoff = min(2 * backoff, self.max_backoff)
+                    continue
+                backoff = self.min_backoff
+                buffers[index] = image
+                yield image
+                index = (index + 1) % self.buffer_count
+        finally:
+            if camera is not None:
+                camera.release()
+
+class FileSource(Source):
+    """
+    A recorded video. With realtime it plays at the frame rate it was recorded at,
+    like a camera would, and otherwise as fast as frames can be read.
+    """
+    def __init__(self, path, realtime = True, loop = True):
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+
+    def read(self, capture):
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    if not self.loop:
+                        return
+                    capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    ok, frame = capture.read()
+                    if not ok:
+                        return
+                yield frame
+        finally:
+            capture.release()
+
+    def frames(self):
+        capture = cv2.VideoCapture(self.path)
+        if not capture.isOpened():
+            raise RuntimeError('Could not open ' + self.path)
+        self.fps = capture.get(cv2.CAP_PROP_FPS) or 30
+        return self.paced(self.read(capture), self.fps) if self.realtime else self.read(capture)
+
+class ImageSequenceSource(Source):
+    """
+    A folder of images (any pattern glob understands), shown in order at fps frames
+    a second.
+    """
+    def __init__(self, pattern, fps = 30, loop = True):
+        self.pattern = pattern
+        self.fps = fps
+        self.loop = loop
+
+    def read(self):
+        paths = sorted(glob.glob(self.pattern))
+        if not paths:
+            raise RuntimeError('No images match ' + self.pattern)
+        while True:
+            for path in paths:
+                frame = cv2.imread(path)
+                if frame is not None:
+                    yield frame
+            if not self.loop:
+                return
+
+    def frames(self):
+        return self.paced(self.read(), self.fps) if self.fps else self.read()
+
+class SyntheticSource(Source):
+    """
+    The benchmark's synthetic scene (see benchmark.py), with blobs for wands acting out
+    its script of calibrating, drawing, making shapes and erasing, over and over.
+    """
+    def __init__(self, width = 640, height = 480, fps = 30, calibration_time = 6, draw_frames = 300):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.calibration_time = calibration_time
+        self.draw_frames = draw_frames
+
+    def read(self):
+        from benchmark import SyntheticScene, script # only needed here, and it brings in the whole drawing program
+        scene = SyntheticScene(self.width, self.height)
+        steps = script(self.width, self.height, self.fps or 30, self.calibration_time, self.draw_frames)
+        while True:
+            for phase, cursor_1, cursor_2 in steps:
+                yield scene.frame(cursor_1, cursor_2)
+
+    def frames(self):
+        return self.paced(self.read(), self.fps) if self.fps else self.read()
+
+def parse_source(spec):
+    """
+    Makes a source from a string like the ones at the top of this file.
+    """
+    kind, _, argument = spec.partition(':')
+    if not argument and kind.isdigit():
+        return DeviceSource(int(kind))
+    argument, _, option = argument.partition('?')
+    if kind == 'device':
+        return DeviceSource(int(argument))
+    if kind == 'file':
+        return FileSource(argument, realtime = option != 'fast')
+    if kind == 'images':
+        return ImageSequenceSource(argument, fps = 0 if option == 'fast' else 30)
+    if kind == 'synthetic':
+        width, height = (int(i) for i in (argument or '640x480').split('x'))
+        return SyntheticSource(width, height, fps = 0 if option == 'fast' else 30)
+    raise ValueError('Unknown video source ' + spec)
+
+def parse_sources(text):
+    """
+    Makes a dictionary of sources by name from a comma separated list of name=spec, like
+    'front=0,back=1,demo=synthetic:640x480'. A spec without a name is called 'default'.
+    """
+    sources = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, _, spec = item.strip().rpartition('=')
+        sources[name or 'default'] = parse_source(spec)
+    return sources
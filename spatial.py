@@ -0,0 +1,184 @@
+import numpy as np
+
+class StrokeGrid:
+    """
+    Sorts the strokes on the canvas into the squares of a uniform grid that they pass
+    through. To find the strokes near a point (like the eraser), only the few squares
+    around it need to be looked at, so it takes the same amount of time no matter how
+    much has been drawn. Each square remembers a stroke once, however many of the
+    stroke's segments go through it. Strokes are usually numbers in a StrokeStore, but
+    anything that can go in a set works, like the shapes in Model.shape_grid.
+    """
+    def __init__(self, cell_size = 32):
+        self.cell_size = cell_size
+        self.cells = {} # (column, row) of a square -> set of the strokes in it
+
+    def cells_between(self, x1, y1, x2, y2):
+        """
+        Returns the (column, row) of every square that overlaps the box between two corners.
+        """
+        columns = range(int(min(x1, x2)) // self.cell_size, int(max(x1, x2)) // self.cell_size + 1)
+        rows = range(int(min(y1, y2)) // self.cell_size, int(max(y1, y2)) // self.cell_size + 1)
+        return [(column, row) for column in columns for row in rows]
+
+    def segment_cells(self, start, end, width):
+        pad = width / 2 + 1 # thick lines reach past their endpoints
+        return self.cells_between(min(start[0], end[0]) - pad, min(start[1], end[1]) - pad, max(start[0], end[0]) + pad, max(start[1], end[1]) + pad)
+
+    def stroke_cells(self, points, width):
+        """
+        Returns the squares that any segment of a stroke passes through, working out the
+        box around every segment at once.
+        """
+        if len(points) < 2:
+            return set()
+        pad = width / 2 + 1
+        starts, ends = points[:-1], points[1:]
+        columns_1 = (np.minimum(starts[:, 0], ends[:, 0]) - pad).astype(int) // self.cell_size
+        columns_2 = (np.maximum(starts[:, 0], ends[:, 0]) + pad).astype(int) // self.cell_size
+        rows_1 = (np.minimum(starts[:, 1], ends[:, 1]) - pad).astype(int) // self.cell_size
+        rows_2 = (np.maximum(starts[:, 1], ends[:, 1]) + pad).astype(int) // self.cell_size
+        cells = set()
+        for dx in range(int((columns_2 - columns_1).max()) + 1): # most segments only cover one or two squares each way
+            for dy in range(int((rows_2 - rows_1).max()) + 1):
+                inside = (columns_1 + dx <= columns_2) & (rows_1 + dy <= rows_2)
+                cells.update(zip((columns_1[inside] + dx).tolist(), (rows_1[inside] + dy).tolist()))
+        return cells
+
+    def add_segment(self, stroke, start, end, width):
+        """
+        Adds the squares that one new segment of a stroke passes through.
+        """
+        for cell in self.segment_cells(start, end, width):
+            self.cells.setdefault(cell, set()).add(stroke)
+
+    def add(self, stroke, points, width):
+        for cell in self.stroke_cells(points, width):
+            self.cells.setdefault(cell, set()).add(stroke)
+
+    def remove(self, stroke, points, width):
+        for cell in self.stroke_cells(points, width):
+            strokes = self.cells.get(cell)
+            if strokes is not None:
+                strokes.discard(stroke)
+                if not strokes:
+                    del self.cells[cell]
+
+    def near(self, x1, y1, x2, y2):
+        """
+        Returns all of the strokes that might overlap the box between two corners. Every
+        stroke that does is included, and some that come close may be too.
+        """
+        strokes = set()
+        for cell in self.cells_between(x1, y1, x2, y2):
+            strokes.update(self.cells.get(cell, ()))
+        return strokes
+
+    def clear(self):
+        self.cells.clear()
+
+    def copy(self):
+        grid = StrokeGrid(self.cell_size)
+        grid.cells = {cell: set(strokes) for cell, strokes in self.cells.items()}
+        return grid
+
+    @property
+    def nbytes(self):
+        return 64 * sum(len(strokes) + 4 for strokes in self.cells.values()) # roughly, with the sets and dictionary around them
+
+def clip_segment(start, end, center, radius):
+    """
+    Works out what is left of the segment from start to end after cutting out everything
+    within radius of center. Returns None if the circle misses the segment. Otherwise
+    returns (before, after): before is where the part kept from start ends, and after is
+    where the part kept up to end begins. Either is None if that part is gone.
+    """
+    start = np.array(start, float)
+    direction = np.array(end, float) - start
+    offset = start - np.array(center, float)
+    a = direction.dot(direction)
+    b = 2 * direction.dot(offset)
+    c = offset.dot(offset) - radius ** 2
+    if a == 0: # the segment is just a dot
+        return (None, None) if c <= 0 else None
+    discriminant = b ** 2 - 4 * a * c
+    if discriminant <= 0:
+        return None
+    t1 = (-b - np.sqrt(discriminant)) / (2 * a) # where the line goes into the circle
+    t2 = (-b + np.sqrt(discriminant)) / (2 * a) # and where it comes back out
+    if t2 <= 0 or t1 >= 1:
+        return None
+    before = tuple(np.round(start + t1 * direction).astype(int)) if t1 > 0 else None
+    after = tuple(np.round(start + t2 * direction).astype(int)) if t2 < 1 else None
+    return before, after
+
+def cut_circle(points, center, radius):
+    """
+    Cuts everything within radius of center out of a stroke, given as an (n, 2) array of
+    points. Returns None if the circle doesn't touch the stroke, and otherwise a list of
+    the arrays of points of the pieces that are left. The distance from the circle to
+    every segment is worked out at once, and only the segments it touches are cut.
+    """
+    if len(points) < 2:
+        return None
+    starts = points[:-1].astype(float)
+    directions = points[1:] - starts
+    lengths = (directions ** 2).sum(axis = 1)
+    along = ((np.array(center, float) - starts) * directions).sum(axis = 1) / np.maximum(lengths, 1e-9)
+    closest = starts + np.clip(along, 0, 1)[:, None] * directions
+    distances = ((closest - np.array(center, float)) ** 2).sum(axis = 1)
+    touched = np.flatnonzero(distances < radius ** 2) + 1 # segment i goes from point i-1 to point i
+    cuts = {}
+    for i in touched:
+        cut = clip_segment(points[i-1], points[i], center, radius)
+        if cut is not None:
+            cuts[i] = cut
+    if not cuts:
+        return None
+
+    pieces = []
+    piece = [points[0:1]]
+    last = 0 # the last point that is already in a piece
+    for i in sorted(cuts):
+        before, after = cuts[i]
+        piece.append(points[last+1:i])
+        if before is not None:
+            piece.append(np.array([before]))
+        pieces.append(np.concatenate(piece))
+        piece = [np.array([after])] if after is not None else []
+        piece.append(points[i:i+1])
+        last = i
+    piece.append(points[last+1:])
+    pieces.append(np.concatenate(piece))
+    return [piece for piece in pieces if len(piece) >= 2 and (piece != piece[0]).any()]
+
+def simplify(points, tolerance):
+    """
+    Ramer-Douglas-Peucker: drops the points of a stroke that are within tolerance of the
+    line through the points kept on either side of them, so a stroke keeps its shape with
+    far fewer points. Works on an (n, 2) array and returns the points that are kept.
+    """
+    if len(points) < 3:
+        return points
+    keep = np.zeros(len(points), bool)
+    keep[0] = keep[-1] = True
+    ranges = [(0, len(points) - 1)]
+    while ranges:
+        first, last = ranges.pop()
+        if last - first < 2:
+            continue
+        start = points[first].astype(float)
+        direction = points[last] - start
+        between = points[first+1:last] - start
+        length = np.hypot(*direction)
+        if length == 0: # the stroke came back to where it started
+            distances = np.hypot(between[:, 0], between[:, 1])
+        else:
+            distances = np.abs(direction[0] * between[:, 1] - direction[1] * between[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            ranges.append((first, middle))
+            ranges.append((middle, last))
+    return points[keep]
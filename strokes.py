@@ -0,0 +1,326 @@
+import numpy as np
+
+POINT = np.dtype([('x', np.int16), ('y', np.int16)])
+STROKE = np.dtype([('start', np.uint32), # where the stroke's points begin in the points array
+    ('length', np.uint32), # how many points it has
+    ('color', np.uint8), # which color in the palette it is
+    ('width', np.uint8),
+    ('order', np.uint32), # when it was drawn, so overlapping strokes are redrawn the same way
+    ('alive', np.bool_)]) # False once it has been erased or cleared
+
+class StrokeStore:
+    """
+    Every line that has been drawn, kept in NumPy arrays instead of lists of tuples. All
+    the points go in one array of 16 bit coordinates, and each stroke (a line drawn
+    without lifting the wand) is a row in a second array that says where its points
+    start, how many there are, and its color and width. Colors are kept once in a small
+    palette, and a stroke just stores which one it uses.
+
+    Points are only ever added to the end. Erasing part of a stroke marks it as not
+    alive and adds what is left of it as new strokes; the space taken up by dead strokes
+    is reclaimed by compact().
+    """
+    __slots__ = ('points', 'point_count', 'strokes', 'stroke_count', 'palette', 'palette_lookup', 'open_stroke', 'live_points', 'generation', 'next_order')
+
+    def __init__(self, capacity = 1024):
+        self.points = np.zeros(capacity, POINT)
+        self.strokes = np.zeros(max(capacity // 16, 16), STROKE)
+        self.point_count = 0
+        self.stroke_count = 0
+        self.palette = [] # BGR colors, as tuples of ints
+        self.palette_lookup = {}
+        self.open_stroke = None # the stroke that new points are added to, if there is one
+        self.live_points = 0
+        self.generation = 0 # goes up whenever stroke numbers start over, so copies of the strokes elsewhere know to start over too
+        self.next_order = 0 # the order of the next thing drawn, which keeps counting when strokes are compacted or cleared
+
+    def __len__(self):
+        """
+        The number of points in strokes that haven't been erased.
+        """
+        return self.live_points
+
+    @property
+    def nbytes(self):
+        return self.points.nbytes + self.strokes.nbytes
+
+    def color_index(self, color):
+        """
+        Returns where a color is in the palette, adding it if it is new. If the palette
+        is full, the closest color already in it is used.
+        """
+        color = tuple(int(round(channel)) for channel in color)
+        index = self.palette_lookup.get(color)
+        if index is None:
+            if len(self.palette) < 256:
+                index = len(self.palette)
+                self.palette.append(color)
+            else:
+                distances = ((np.array(self.palette) - np.array(color)) ** 2).sum(axis = 1)
+                index = int(np.argmin(distances))
+            self.palette_lookup[color] = index
+        return index
+
+    def color(self, stroke):
+        return self.palette[self.strokes[stroke]['color']]
+
+    def grow(self, points, strokes):
+        """
+        Makes sure there is room for this many more points and strokes, doubling the
+        size of the arrays when they are full.
+        """
+        if self.point_count + points > len(self.points):
+            bigger = np.zeros(max(2 * len(self.points), self.point_count + points), POINT)
+            bigger[:self.point_count] = self.points[:self.point_count]
+            self.points = bigger
+        if self.stroke_count + strokes > len(self.strokes):
+            bigger = np.zeros(max(2 * len(self.strokes), self.stroke_count + strokes), STROKE)
+            bigger[:self.stroke_count] = self.strokes[:self.stroke_count]
+            self.strokes = bigger
+
+    def take_order(self):
+        """
+        Returns the order for something new that is drawn. Rectangles and circles take
+        theirs from here too, so strokes and shapes can be redrawn in the order they were
+        drawn in.
+        """
+        order = self.next_order
+        self.next_order += 1
+        return order
+
+    def new_stroke(self, color, width, order = None):
+        self.grow(0, 1)
+        stroke = self.stroke_count
+        self.strokes[stroke] = (self.point_count, 0, color, width, self.take_order() if order is None else order, True)
+        self.stroke_count += 1
+        return stroke
+
+    def append(self, x, y, color, width):
+        """
+        Adds a point to the end of the open stroke, starting a new stroke if there isn't
+        one open or the color or width changed (in which case the new stroke starts from
+        the last point, so the line stays connected). Returns the stroke it went in.
+        """
+        color = self.color_index(color)
+        stroke = self.open_stroke
+        if stroke is not None and (self.strokes[stroke]['color'] != color or self.strokes[stroke]['width'] != width):
+            last = self.last_point()
+            stroke = self.new_stroke(color, width)
+            self.add_point(stroke, *last)
+        elif stroke is None:
+            stroke = self.new_stroke(color, width)
+        self.add_point(stroke, x, y)
+        self.open_stroke = stroke
+        return stroke
+
+    def add_point(self, stroke, x, y):
+        self.grow(1, 0)
+        self.points[self.point_count] = (x, y)
+        self.point_count += 1
+        self.strokes['length'][stroke] += 1
+        self.live_points += 1
+
+    def split_open(self):
+        """
+        Ends the open stroke and opens a new one with the same color and width, starting
+        from its last point so the line carries on. Returns the new stroke.
+        """
+        last = self.last_point()
+        color, width = self.strokes[self.open_stroke]['color'], self.strokes[self.open_stroke]['width']
+        stroke = self.new_stroke(color, width)
+        self.add_point(stroke, *last)
+        self.open_stroke = stroke
+        return stroke
+
+    def end_stroke(self):
+        """
+        Stops adding to the open stroke, so the next point starts a new one.
+        """
+        self.open_stroke = None
+
+    def replace_open_points(self, points):
+        """
+        Swaps the points of the open stroke for new ones, like a simplified version of it.
+        The open stroke's points are always the last ones in the array, so this only
+        needs to overwrite them and move the end back.
+        """
+        stroke = self.open_stroke
+        start, length = int(self.strokes[stroke]['start']), int(self.strokes[stroke]['length'])
+        self.points['x'][start:start + len(points)] = points[:, 0]
+        self.points['y'][start:start + len(points)] = points[:, 1]
+        self.point_count = start + len(points)
+        self.strokes['length'][stroke] = len(points)
+        self.live_points += len(points) - length
+
+    def last_point(self):
+        """
+        The (x, y) of the newest point of the open stroke, or None if no stroke is open.
+        """
+        if self.open_stroke is None or self.strokes[self.open_stroke]['length'] == 0:
+            return None
+        point = self.points[self.point_count - 1]
+        return (int(point['x']), int(point['y']))
+
+    def add_stroke(self, points, color, width, order = None):
+        """
+        Adds a whole stroke from an array of (x, y) points, with a color index from the
+        palette. Returns the new stroke.
+        """
+        self.end_stroke()
+        self.grow(len(points), 1)
+        stroke = self.new_stroke(color, width, order)
+        self.points['x'][self.point_count:self.point_count + len(points)] = points[:, 0]
+        self.points['y'][self.point_count:self.point_count + len(points)] = points[:, 1]
+        self.point_count += len(points)
+        self.strokes['length'][stroke] = len(points)
+        self.live_points += len(points)
+        return stroke
+
+    def remove_stroke(self, stroke):
+        if self.strokes[stroke]['alive']:
+            self.strokes['alive'][stroke] = False
+            self.live_points -= int(self.strokes[stroke]['length'])
+        if stroke == self.open_stroke:
+            self.open_stroke = None
+
+    def stroke_points(self, stroke):
+        """
+        Returns the points of a stroke as an (n, 2) array of ints.
+        """
+        start, length = int(self.strokes[stroke]['start']), int(self.strokes[stroke]['length'])
+        points = self.points[start:start + length]
+        return np.stack((points['x'], points['y']), axis = 1).astype(np.int32)
+
+    def __iter__(self):
+        """
+        Goes through every stroke that is still alive, giving (stroke, points, color, width).
+        """
+        return self.iterate()
+
+    def iterate(self, strokes = None):
+        """
+        Like iterating over the store, but only over the given strokes if there are any,
+        and in the order they were drawn.
+        """
+        if strokes is None:
+            strokes = np.flatnonzero(self.strokes['alive'][:self.stroke_count])
+        strokes = sorted((int(stroke) for stroke in strokes if self.strokes[stroke]['alive']), key = lambda stroke: self.strokes[stroke]['order'])
+        for stroke in strokes:
+            yield stroke, self.stroke_points(stroke), self.color(stroke), int(self.strokes[stroke]['width'])
+
+    def rasterize(self, canvas, strokes = None):
+        """
+        Draws the strokes (all of them, or just the ones given) onto a canvas.
+        """
+        for stroke, points, color, width in self.iterate(strokes):
+            canvas.draw_polyline(points, color, width)
+
+    def dead_points(self):
+        return self.point_count - self.live_points
+
+    def compact(self):
+        """
+        Throws away the points of strokes that are no longer alive. Stroke numbers change,
+        so returns a dictionary from each old stroke number to its new one.
+        """
+        alive = np.flatnonzero(self.strokes['alive'][:self.stroke_count])
+        points = np.zeros(max(self.live_points, 1024), POINT)
+        strokes = np.zeros(max(len(alive), 16), STROKE)
+        renumber = {}
+        count = 0
+        for new, old in enumerate(alive):
+            start, length = int(self.strokes[old]['start']), int(self.strokes[old]['length'])
+            points[count:count + length] = self.points[start:start + length]
+            strokes[new] = self.strokes[old]
+            strokes['start'][new] = count
+            count += length
+            renumber[int(old)] = new
+        self.points, self.strokes = points, strokes
+        self.point_count, self.stroke_count = count, len(alive)
+        self.open_stroke = renumber.get(self.open_stroke)
+        self.generation += 1
+        return renumber
+
+    def copy(self):
+        """
+        Returns a separate store with the same strokes, with arrays only as big as they
+        need to be. The open stroke isn't carried over.
+        """
+        store = StrokeStore(0)
+        store.points = self.points[:max(self.point_count, 1)].copy()
+        store.strokes = self.strokes[:max(self.stroke_count, 1)].copy()
+        store.point_count, store.stroke_count = self.point_count, self.stroke_count
+        store.palette = list(self.palette)
+        store.palette_lookup = dict(self.palette_lookup)
+        store.live_points = self.live_points
+        store.generation = self.generation
+        store.next_order = self.next_order
+        return store
+
+    def clear(self):
+        self.point_count = 0
+        self.stroke_count = 0
+        self.live_points = 0
+        self.open_stroke = None
+        self.generation += 1
+
+class StrokeFilter:
+    """
+    Cleans up the positions of the drawing wand before they are added to a stroke. The
+    center of the wand jitters by a few pixels every frame, and once in a while it jumps
+    somewhere it can't have moved to, when something else the same color is found. So:
+
+    - a point faster than max_speed pixels a second from the last one is thrown away,
+      unless max_jumps points in a row are, in which case the wand really did move and
+      a new stroke starts where it is now
+    - points are smoothed by moving only part of the way (smoothing) to each new one
+    - a point less than min_distance from the last one added is dropped
+
+    Strokes are also simplified (see spatial.simplify) with tolerance once they end.
+    """
+    def __init__(self, min_distance = 2, max_speed = 5000, smoothing = 0.5, max_jumps = 3, tolerance = 1.5):
+        self.min_distance = min_distance
+        self.max_speed = max_speed
+        self.smoothing = smoothing
+        self.max_jumps = max_jumps
+        self.tolerance = tolerance
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the last stroke, so the next point starts a new one from where it is.
+        """
+        self.raw = None # the last point that wasn't thrown away
+        self.time = None # when the last point was seen
+        self.smoothed = None
+        self.added = None # the last point that was let through
+        self.jumps = 0
+        self.jumped = False
+
+    def add(self, x, y, time):
+        """
+        Returns the (x, y) to add to the stroke for a wand seen at (x, y), or None if
+        nothing should be added. If the point starts a new stroke because the wand jumped
+        there, jumped is set to True.
+        """
+        self.jumped = False
+        if self.raw is not None:
+            distance = ((x - self.raw[0]) ** 2 + (y - self.raw[1]) ** 2) ** 0.5
+            seconds, self.time = max(time - self.time, 1 / 30), time # since the last point seen, even if it was thrown away
+            if distance / seconds > self.max_speed:
+                self.jumps += 1
+                if self.jumps < self.max_jumps:
+                    return None
+                self.reset()
+                self.jumped = True
+        self.jumps = 0
+        self.raw, self.time = (x, y), time
+        if self.smoothed is None:
+            self.smoothed = (float(x), float(y))
+        else:
+            self.smoothed = (self.smoothed[0] + self.smoothing * (x - self.smoothed[0]), self.smoothed[1] + self.smoothing * (y - self.smoothed[1]))
+        point = (int(round(self.smoothed[0])), int(round(self.smoothed[1])))
+        if self.added is not None and (point[0] - self.added[0]) ** 2 + (point[1] - self.added[1]) ** 2 < self.min_distance ** 2:
+            return None
+        self.added = point
+        return point
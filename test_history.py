@@ -0,0 +1,77 @@
+import numpy as np
+from mini_project_4 import Model
+
+RED, GREEN, BLUE = (0, 0, 255), (0, 255, 0), (255, 0, 0)
+
+def new_model():
+    model = Model()
+    model.tool = 'draw'
+    model.canvas.fit(np.zeros((480, 640, 3), np.uint8))
+    time = [0.0]
+    def clock():
+        time[0] += 1 / 30
+        return time[0]
+    model.clock = clock
+    return model
+
+def draw_line(model, start, end, color, width, steps = 200):
+    for x, y in np.linspace(start, end, steps).round().astype(int):
+        model.add_line_point((int(x), int(y), color, 0, width))
+    model.add_line_point(False)
+
+def draw_rectangle(model, corner_1, corner_2, color, width):
+    model.add_rectangle_point(corner_1 + (color, 0, width))
+    model.add_rectangle_point(corner_2 + (color, 0, width))
+    model.add_rectangle_point(False)
+    model.record('rectangle', model.rectangle_points[-3:])
+
+def draw_circle(model, center, radius, color, width):
+    model.ellipse_points.append(center + (color, 0, width))
+    model.add_ellipse_radius(radius)
+    model.ellipse_points.append(False)
+    model.record('ellipse', model.ellipse_points[-3:])
+
+def picture(model):
+    return model.canvas.image.copy(), model.canvas.mask.copy()
+
+def assert_same(a, b):
+    assert np.array_equal(a[0], b[0]) and np.array_equal(a[1], b[1])
+
+def test_undo_redo_gives_back_the_same_picture():
+    """
+    Shapes and lines crossing each other, in both orders, come back with the same pixels
+    after undoing and redoing, whichever checkpoint the undo starts from.
+    """
+    model = new_model()
+    model.history.interval = 3
+    draw_rectangle(model, (100, 100), (300, 300), RED, 9)
+    draw_line(model, (50, 200), (350, 200), BLUE, 9) # over the rectangle
+    draw_rectangle(model, (150, 150), (250, 250), GREEN, 7) # over the line
+    draw_circle(model, (200, 200), 80, BLUE, 5)
+    draw_line(model, (200, 50), (200, 350), RED, 11) # over all of them, long enough to be split into pieces
+    model.erase_at((200, 120), 10)
+    model.end_erase()
+    draw_line(model, (120, 380), (320, 60), GREEN, 5)
+    pictures = [None] * model.history.position + [picture(model)]
+    while model.history.can_undo():
+        position = model.history.position
+        model.undo()
+        pictures[position - 1] = picture(model)
+        model.redo()
+        assert_same(picture(model), pictures[position])
+        model.undo()
+    while model.history.can_redo():
+        model.redo()
+        assert_same(picture(model), pictures[model.history.position])
+
+def test_redraw_gives_the_same_picture():
+    model = new_model()
+    draw_rectangle(model, (100, 100), (300, 300), RED, 9)
+    draw_line(model, (50, 200), (350, 200), BLUE, 9)
+    draw_circle(model, (200, 200), 80, GREEN, 5)
+    live = picture(model)
+    assert tuple(live[0][200, 100]) == BLUE # where the line crosses the rectangle, it is on top
+    model.redraw_canvas((90, 190, 110, 210))
+    assert_same(picture(model), live)
+    model.redraw_canvas()
+    assert_same(picture(model), live)